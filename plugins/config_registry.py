@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+# plugins/config_registry.py
+"""
+Shared registry of the project's text/INI config files.
+
+Each file is parsed once and re-parsed only when its (mtime_ns, size)
+changes. Python code reads it with get("<file name>"); browsers get every
+file (raw text plus parsed data) as one JSON bundle at /-/config.json,
+with a strong ETag so repeat page loads are answered with 304.
+
+Other plugins (and the /-/config.json route) go through registry(): it
+puts plugins/ on sys.path and imports this file normally as the module
+"config_registry", so there is a single cache per process.
+"""
+
+import os
+import sys
+import json
+import hashlib
+import threading
+
+from datasette import hookimpl
+from datasette.utils.asgi import Response
+
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CUSTOM_DIR = os.path.join(BASE_DIR, "static", "custom")
+
+def _read_lines(text):
+    for raw in text.splitlines():
+        line = raw.strip()
+        if line and not line.startswith("#") and not line.startswith(";"):
+            yield line
+
+
+def _parse_fk_ini(text):
+    """sex_fk.ini: "tabella.colonna" (optionally "= commento") -> {tabella: colonna}."""
+    mapping = {}
+    for line in _read_lines(text):
+        key = line.split("=", 1)[0].strip()
+        if "." not in key:
+            continue
+        table, column = (x.strip() for x in key.split(".", 1))
+        if table and column:
+            mapping[table] = column
+    return mapping
+
+
+def _parse_table_columns(text):
+    """ "table: col1, col2" or "table.col" lines -> {table: [cols]} (order kept, no duplicates)."""
+    out = {}
+    for line in _read_lines(text):
+        if ":" in line:
+            table, cols = line.split(":", 1)
+            cols = cols.split(",")
+        elif "." in line:
+            table, col = line.split(".", 1)
+            cols = [col]
+        else:
+            continue
+        table = table.strip()
+        if not table:
+            continue
+        dest = out.setdefault(table, [])
+        for c in cols:
+            c = c.strip()
+            if c and c not in dest:
+                dest.append(c)
+    return out
+
+
+def _parse_dotted(text):
+    """ "table.column" lines -> [[table, column], ...]."""
+    out = []
+    for line in _read_lines(text):
+        if "." in line:
+            table, column = (x.strip() for x in line.split(".", 1))
+            if table and column:
+                out.append([table, column])
+    return out
+
+
+# name -> (candidate paths, first existing wins; parser)
+CONFIG_FILES = {
+    "sex_fk.ini": ([os.path.join(BASE_DIR, "sex_fk.ini")], _parse_fk_ini),
+    "not_booleans.txt": (
+        [os.path.join(BASE_DIR, "not_booleans.txt"), os.path.join(CUSTOM_DIR, "not_booleans.txt")],
+        _parse_table_columns,
+    ),
+    "link_columns.txt": ([os.path.join(CUSTOM_DIR, "link_columns.txt")], _parse_table_columns),
+    "timestamp_columns.txt": ([os.path.join(CUSTOM_DIR, "timestamp_columns.txt")], _parse_table_columns),
+    "calendar_columns.txt": ([os.path.join(CUSTOM_DIR, "calendar_columns.txt")], _parse_dotted),
+}
+
+# {name: (signature, entry)}; entry = {"path", "mtime", "text", "data"}
+_CACHE = {}
+# {"key": tuple of signatures, "etag": ..., "body": ...}
+_BUNDLE = {}
+_LOCK = threading.Lock()
+
+
+def _signature(paths):
+    """(path, mtime_ns, size) of the first existing candidate, or None."""
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        return (path, st.st_mtime_ns, st.st_size)
+    return None
+
+
+def _entry(name):
+    paths, parser = CONFIG_FILES[name]
+    sig = _signature(paths)
+    cached = _CACHE.get(name)
+    if cached and cached[0] == sig:
+        return sig, cached[1]
+    with _LOCK:
+        text = ""
+        if sig is not None:
+            try:
+                with open(sig[0], "r", encoding="utf-8-sig") as f:
+                    text = f.read()
+            except OSError:
+                sig = None
+        entry = {
+            "path": os.path.relpath(sig[0], BASE_DIR).replace(os.sep, "/") if sig else None,
+            "mtime": sig[1] / 1e9 if sig else None,
+            "text": text,
+            "data": parser(text),
+        }
+        _CACHE[name] = (sig, entry)
+    return sig, entry
+
+
+def get(name):
+    """Parsed content of a config file (empty when the file is missing)."""
+    return _entry(name)[1]["data"]
+
+
+def get_text(name):
+    return _entry(name)[1]["text"]
+
+
+def bundle():
+    """(etag, JSON body bytes) of every config file, rebuilt when any of them changes."""
+    entries = {name: _entry(name) for name in CONFIG_FILES}
+    key = tuple(sig for sig, _ in entries.values())
+    if _BUNDLE.get("key") != key:
+        files = {name: entry for name, (_, entry) in entries.items()}
+        payload = json.dumps({"files": files}, ensure_ascii=False, sort_keys=True).encode("utf-8")
+        version = hashlib.sha256(payload).hexdigest()[:16]
+        body = json.dumps({"version": version, "files": files}, ensure_ascii=False, sort_keys=True).encode("utf-8")
+        _BUNDLE.update(key=key, etag=f'"{version}"', body=body)
+    return _BUNDLE["etag"], _BUNDLE["body"]
+
+
+def registry():
+    """The shared "config_registry" module, importable from any plugin (or process-pool worker)."""
+    plugins_dir = os.path.dirname(os.path.abspath(__file__))
+    if plugins_dir not in sys.path:
+        sys.path.append(plugins_dir)
+    import config_registry
+
+    return config_registry
+
+
+async def config_json(request, datasette):
+    """
+    GET /-/config.json
+    {"version", "files": {name: {path, mtime, text, data}}}; 304 on a matching If-None-Match.
+    """
+    etag, body = registry().bundle()
+    headers = {"etag": etag, "cache-control": "no-cache"}
+    inm = request.headers.get("if-none-match", "")
+    if etag in [t.strip().replace("W/", "", 1) for t in inm.split(",")] or inm.strip() == "*":
+        return Response(b"", status=304, headers=headers)
+    return Response(body, headers=headers, content_type="application/json; charset=utf-8")
+
+
+@hookimpl
+def register_routes():
+    return [
+        (r"^/-/config\.json$", config_json),
+    ]
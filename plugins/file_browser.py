@@ -1,4 +1,3 @@
-
 # -*- coding: utf-8 -*-
 """Simple file browser for Datasette.
 
@@ -6,11 +5,20 @@ Espone /files/ per navigare i dischi C: e Z:
 direttamente dal browser (ad esempio via Tailscale da telefono).
 """
 import os
+import time
+import uuid
+import asyncio
+import mimetypes
 import posixpath
+import threading
+import email.utils
 import urllib.parse
+import concurrent.futures
+from collections import OrderedDict
+from datetime import datetime
 
 from datasette import hookimpl
-from datasette.utils.asgi import Response, AsgiFileDownload
+from datasette.utils.asgi import Response, NotFound, Forbidden
 
 # Mappa le lettere di drive ai path reali su Windows
 DRIVES = {
@@ -18,6 +26,29 @@ DRIVES = {
     "Z": "Z:\\",
 }
 
+# Elenchi paginati: ?offset=&limit=&sort=name|size|mtime&order=asc|desc
+LISTING_PAGE = 500
+LISTING_MAX_PAGE = 5000
+# elenchi ordinati tenuti in memoria, per cartella/ordinamento: si
+# rileggono se cambia l'mtime della cartella o dopo LISTING_TTL secondi
+LISTING_CACHE_SIZE = 8
+LISTING_TTL = 30.0
+
+_SORTS = ("name", "size", "mtime")
+
+# Download: blocchi letti nel pool quando il server ASGI non offre lo
+# zero-copy; oltre DOWNLOAD_MAX_RANGES intervalli si manda il file intero
+DOWNLOAD_CHUNK = 256 * 1024
+DOWNLOAD_MAX_RANGES = 16
+
+# Tutto il filesystem (scandir/stat, lenti su Z: in rete) gira qui, mai
+# sull'event loop: una cartella enorme non blocca le altre richieste
+_FS_POOL = concurrent.futures.ThreadPoolExecutor(max_workers=4, thread_name_prefix="file_browser")
+
+# {(full_path, sort, desc): (mtime_ns cartella, letto alle, righe)}
+_LISTINGS = OrderedDict()
+_LISTINGS_LOCK = threading.Lock()
+
 
 def _safe_join(base, rel_path):
     """Join base and rel_path assicurandosi di restare dentro base.
@@ -50,6 +81,320 @@ def _safe_join(base, rel_path):
     return full_path, normalized_rel
 
 
+async def _in_pool(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(_FS_POOL, fn, *args)
+
+
+def _stat_row(row):
+    """Dimensione e mtime di una riga; DirEntry.stat() è in cache (e gratis su Windows)."""
+    if "mtime" not in row:
+        try:
+            st = row["entry"].stat()
+            row["size"] = None if row["is_dir"] else st.st_size
+            row["mtime"] = st.st_mtime
+        except OSError:
+            row["size"] = row["mtime"] = None
+    return row
+
+
+def _sort_key(sort):
+    if sort == "size":
+        return lambda r: (r["size"] or 0, r["name"].lower())
+    if sort == "mtime":
+        return lambda r: (r["mtime"] or 0, r["name"].lower())
+    return lambda r: r["name"].lower()
+
+
+def _scan_dir(full_path, sort, desc):
+    """
+    Tutte le voci (non nascoste) della cartella, cartelle prima, ordinate.
+
+    scandir dà il tipo senza stat per voce; lo stat serve solo per ordinare
+    per size/mtime, altrimenti lo fa _page_rows sulle voci della pagina.
+    """
+    rows = []
+    try:
+        with os.scandir(full_path) as it:
+            for entry in it:
+                if entry.name.startswith("."):
+                    continue
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                rows.append({"name": entry.name, "is_dir": is_dir, "entry": entry})
+    except PermissionError:
+        return []
+    if sort != "name":
+        for row in rows:
+            _stat_row(row)
+    key = _sort_key(sort)
+    dirs = sorted((r for r in rows if r["is_dir"]), key=key, reverse=desc)
+    files = sorted((r for r in rows if not r["is_dir"]), key=key, reverse=desc)
+    return dirs + files
+
+
+def _listing(full_path, sort, desc):
+    """Elenco ordinato della cartella, dalla cache se la cartella non è cambiata."""
+    dir_mtime = os.stat(full_path).st_mtime_ns
+    key = (full_path, sort, desc)
+    with _LISTINGS_LOCK:
+        cached = _LISTINGS.get(key)
+        if cached and cached[0] == dir_mtime and time.monotonic() - cached[1] < LISTING_TTL:
+            _LISTINGS.move_to_end(key)
+            return cached[2]
+    rows = _scan_dir(full_path, sort, desc)
+    with _LISTINGS_LOCK:
+        _LISTINGS[key] = (dir_mtime, time.monotonic(), rows)
+        _LISTINGS.move_to_end(key)
+        while len(_LISTINGS) > LISTING_CACHE_SIZE:
+            _LISTINGS.popitem(last=False)
+    return rows
+
+
+def _page_rows(full_path, sort, desc, offset, limit):
+    """(totale voci, voci della pagina con size/mtime)."""
+    rows = _listing(full_path, sort, desc)
+    page = [_stat_row(r) for r in rows[offset:offset + limit]]
+    return len(rows), page
+
+
+def _path_kind(path):
+    """'dir', 'file' o None, fuori dall'event loop."""
+    if os.path.isdir(path):
+        return "dir"
+    if os.path.isfile(path):
+        return "file"
+    return None
+
+
+def _human_size(size):
+    if size is None:
+        return ""
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+def _listing_args(request):
+    """(offset, limit, sort, desc) dalla query string, con valori di default sensati."""
+    try:
+        offset = max(int(request.args.get("offset") or 0), 0)
+    except ValueError:
+        offset = 0
+    try:
+        limit = min(max(int(request.args.get("limit") or LISTING_PAGE), 1), LISTING_MAX_PAGE)
+    except ValueError:
+        limit = LISTING_PAGE
+    sort = request.args.get("sort") or "name"
+    if sort not in _SORTS:
+        sort = "name"
+    desc = request.args.get("order") == "desc"
+    return offset, limit, sort, desc
+
+
+def _listing_url(path, offset, limit, sort, desc):
+    args = {}
+    if offset:
+        args["offset"] = offset
+    if limit != LISTING_PAGE:
+        args["limit"] = limit
+    if sort != "name":
+        args["sort"] = sort
+    if desc:
+        args["order"] = "desc"
+    return path + ("?" + urllib.parse.urlencode(args) if args else "")
+
+
+# ---- download: Range, richieste condizionali, zero-copy -----------------------
+
+def _etag_matches(header, etag):
+    """If-None-Match: confronto debole, anche con più tag o '*'."""
+    tags = [t.strip() for t in header.split(",")]
+    return "*" in tags or etag in [t[2:] if t.startswith("W/") else t for t in tags]
+
+
+def _not_modified(request, etag, mtime):
+    """If-None-Match ha la precedenza; altrimenti If-Modified-Since (al secondo)."""
+    inm = request.headers.get("if-none-match")
+    if inm is not None:
+        return _etag_matches(inm, etag)
+    ims = request.headers.get("if-modified-since")
+    if ims:
+        try:
+            since = email.utils.parsedate_to_datetime(ims).timestamp()
+        except (TypeError, ValueError, IndexError, OverflowError):
+            return False
+        return int(mtime) <= since
+    return False
+
+
+def _parse_ranges(header, size):
+    """
+    Header Range -> [(inizio, fine inclusa)] ordinati e fusi.
+
+    [] se nessun intervallo è soddisfacibile (-> 416); None se l'header va
+    ignorato (unità diversa da bytes, sintassi errata, troppi intervalli).
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or not spec.strip():
+        return None
+    ranges = []
+    parts = [p.strip() for p in spec.split(",") if p.strip()]
+    if len(parts) > DOWNLOAD_MAX_RANGES:
+        return None
+    for part in parts:
+        first, sep, last = part.partition("-")
+        if not sep:
+            return None
+        try:
+            if not first.strip():
+                # "-N": gli ultimi N byte
+                n = int(last)
+                if n <= 0:
+                    continue
+                start, end = max(size - n, 0), size - 1
+            else:
+                start = int(first)
+                end = int(last) if last.strip() else None
+                if start < 0 or (end is not None and start > end):
+                    return None
+                end = size - 1 if end is None else min(end, size - 1)
+        except ValueError:
+            return None
+        if start < size:
+            ranges.append((start, end))
+    ranges.sort()
+    merged = []
+    for start, end in ranges:
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _read_at(f, offset, n):
+    f.seek(offset)
+    return f.read(n)
+
+
+async def _wait_disconnect(receive):
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+async def _send_file(request, send, receive, full_path):
+    """
+    Risponde con il file: 200, 206 (un intervallo o multipart/byteranges),
+    304 (If-None-Match / If-Modified-Since) o 416.
+
+    Se il server ASGI supporta l'estensione http.response.zerocopysend i
+    byte partono con os.sendfile; altrimenti a blocchi letti nel pool. Un
+    client che si disconnette (es. salto nel video) ferma subito l'invio.
+    """
+    try:
+        st = await _in_pool(os.stat, full_path)
+    except OSError:
+        raise NotFound("File inesistente")
+    size = st.st_size
+    etag = f'"{st.st_mtime_ns:x}-{size:x}"'
+    last_modified = email.utils.formatdate(st.st_mtime, usegmt=True)
+    content_type = mimetypes.guess_type(full_path)[0] or "application/octet-stream"
+    headers = [
+        [b"accept-ranges", b"bytes"],
+        [b"etag", etag.encode()],
+        [b"last-modified", last_modified.encode()],
+        [b"cache-control", b"no-cache"],
+    ]
+
+    if _not_modified(request, etag, st.st_mtime):
+        await send({"type": "http.response.start", "status": 304, "headers": headers})
+        await send({"type": "http.response.body", "body": b""})
+        return
+
+    ranges = None
+    range_header = request.headers.get("range")
+    if range_header:
+        # If-Range: gli intervalli valgono solo se il file è ancora quello
+        if_range = request.headers.get("if-range")
+        if if_range is None or if_range.strip() in (etag, last_modified):
+            ranges = _parse_ranges(range_header, size)
+    if ranges == []:
+        headers.append([b"content-range", f"bytes */{size}".encode()])
+        await send({"type": "http.response.start", "status": 416, "headers": headers})
+        await send({"type": "http.response.body", "body": b""})
+        return
+
+    # parti del corpo: (intestazione multipart, inizio, fine inclusa)
+    trailer = b""
+    if not ranges:
+        status = 200
+        parts = [(b"", 0, size - 1)] if size else []
+        headers.append([b"content-type", content_type.encode()])
+    elif len(ranges) == 1:
+        status = 206
+        start, end = ranges[0]
+        parts = [(b"", start, end)]
+        headers.append([b"content-type", content_type.encode()])
+        headers.append([b"content-range", f"bytes {start}-{end}/{size}".encode()])
+    else:
+        status = 206
+        boundary = uuid.uuid4().hex
+        parts = [
+            (
+                f"\r\n--{boundary}\r\ncontent-type: {content_type}\r\n"
+                f"content-range: bytes {start}-{end}/{size}\r\n\r\n".encode(),
+                start,
+                end,
+            )
+            for start, end in ranges
+        ]
+        trailer = f"\r\n--{boundary}--\r\n".encode()
+        headers.append([b"content-type", f"multipart/byteranges; boundary={boundary}".encode()])
+    length = sum(len(head) + end - start + 1 for head, start, end in parts) + len(trailer)
+    headers.append([b"content-length", str(length).encode()])
+
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    if request.method == "HEAD" or not parts:
+        await send({"type": "http.response.body", "body": trailer})
+        return
+
+    zerocopy = "http.response.zerocopysend" in (request.scope.get("extensions") or {})
+    disconnected = asyncio.ensure_future(_wait_disconnect(receive))
+    f = await _in_pool(open, full_path, "rb")
+    try:
+        for head, start, end in parts:
+            if head:
+                await send({"type": "http.response.body", "body": head, "more_body": True})
+            if zerocopy:
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": f,
+                    "offset": start,
+                    "count": end - start + 1,
+                    "more_body": True,
+                })
+                continue
+            pos = start
+            while pos <= end:
+                if disconnected.done():
+                    return
+                chunk = await _in_pool(_read_at, f, pos, min(DOWNLOAD_CHUNK, end - pos + 1))
+                if not chunk:
+                    # file accorciato durante l'invio
+                    return
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+                pos += len(chunk)
+        await send({"type": "http.response.body", "body": trailer})
+    finally:
+        disconnected.cancel()
+        await _in_pool(f.close)
+
+
 @hookimpl
 def register_routes(datasette):
     """Registra le route:
@@ -67,7 +412,8 @@ async def files_root(datasette, request):
     """Pagina root: scelta del disco da esplorare."""
     drives = []
     for letter, base in DRIVES.items():
-        if os.path.exists(base):
+        # un drive di rete scollegato può metterci secondi a rispondere
+        if await _in_pool(os.path.exists, base):
             drives.append(
                 {
                     "name": f"{letter}:",
@@ -91,12 +437,12 @@ async def files_root(datasette, request):
     return Response.html(html)
 
 
-async def file_browser(datasette, request, send):
+async def file_browser(datasette, request, send, receive):
     """Esplora un drive/percorso specifico o scarica un file."""
     drive = request.url_vars.get("drive", "").upper()
     base = DRIVES.get(drive)
     if base is None:
-        raise datasette.NotFound("Drive non consentito")
+        raise NotFound("Drive non consentito")
 
     rel_path = request.url_vars.get("path") or ""
     rel_path = urllib.parse.unquote(rel_path)
@@ -104,31 +450,54 @@ async def file_browser(datasette, request, send):
     try:
         full_path, normalized_rel = _safe_join(base, rel_path)
     except PermissionError as ex:
-        raise datasette.Forbidden(str(ex))
+        raise Forbidden(str(ex))
+
+    kind = await _in_pool(_path_kind, full_path)
+    if kind is None:
+        raise NotFound("File o cartella inesistente")
 
-    if os.path.isdir(full_path):
+    if kind == "dir":
+        offset, limit, sort, desc = _listing_args(request)
         try:
-            entries = sorted(os.listdir(full_path), key=str.lower)
-        except PermissionError:
-            entries = []
+            total, page = await _in_pool(_page_rows, full_path, sort, desc, offset, limit)
+        except OSError:
+            total, page = 0, []
 
         dirs = []
         files = []
-        for name in entries:
-            if name.startswith("."):
-                continue
-
-            child_full = os.path.join(full_path, name)
+        for row in page:
+            name = row["name"]
             child_rel = (
                 posixpath.join(normalized_rel, name) if normalized_rel else name
             )
             encoded_rel = urllib.parse.quote(child_rel)
             child_url = f"/files/{drive}/{encoded_rel}"
+            item = {
+                "name": name,
+                "size": _human_size(row["size"]),
+                "mtime": datetime.fromtimestamp(row["mtime"]).strftime("%Y-%m-%d %H:%M") if row["mtime"] else "",
+            }
 
-            if os.path.isdir(child_full):
-                dirs.append({"name": name, "url": child_url + "/"})
+            if row["is_dir"]:
+                dirs.append(dict(item, url=child_url + "/"))
             else:
-                files.append({"name": name, "url": child_url})
+                files.append(dict(item, url=child_url))
+
+        here = request.path
+        pagination = {
+            "total": total,
+            "first": offset + 1 if page else 0,
+            "last": offset + len(page),
+            "prev_url": _listing_url(here, max(offset - limit, 0), limit, sort, desc) if offset else None,
+            "next_url": _listing_url(here, offset + limit, limit, sort, desc) if offset + limit < total else None,
+            "sort": sort,
+            "order": "desc" if desc else "asc",
+            # clic sulla colonna già ordinata: inverte l'ordine
+            "sort_urls": {
+                s: _listing_url(here, 0, limit, s, not desc if s == sort else s != "name")
+                for s in _SORTS
+            },
+        }
 
         parent_url = None
         if normalized_rel:
@@ -147,6 +516,7 @@ async def file_browser(datasette, request, send):
                 "dirs": dirs,
                 "files": files,
                 "parent_url": parent_url,
+                "pagination": pagination,
             },
             request=request,
         )
@@ -154,7 +524,6 @@ async def file_browser(datasette, request, send):
         await response.asgi_send(send)
         return
 
-    # Se è un file, lo streammiamo al client
-    download = AsgiFileDownload(full_path)
-    await download.asgi_send(send)
+    # Se è un file, lo mandiamo al client (Range, 304, zero-copy se possibile)
+    await _send_file(request, send, receive, full_path)
     # Nessun ritorno: abbiamo già risposto via send()
@@ -0,0 +1,450 @@
+# plugins/insert_form.py
+# -*- coding: utf-8 -*-
+# v1 - form di inserimento generico per qualsiasi tabella: /-/insert/<tabella>
+"""
+Form di inserimento generico, guidato dallo schema.
+
+Per ogni tabella lo schema del form e l'INSERT parametrizzato vengono
+"compilati" una volta sola (PRAGMA table_info + PRAGMA foreign_key_list)
+e tenuti in cache finché PRAGMA schema_version non cambia. Ogni submit è
+quindi una sola istruzione preparata, sempre con lo stesso testo SQL.
+
+Colonne FK:
+  - dichiarate con REFERENCES (PRAGMA foreign_key_list), oppure
+  - per convenzione <tabella>_id, se <tabella> è in sex_fk.ini.
+L'etichetta mostrata è la colonna di sex_fk.ini per quella tabella,
+altrimenti la prima colonna testuale della tabella referenziata.
+
+Datasette carica questo file come plugin "insert_form.py"; le route e gli
+altri plugin (sex_form.py, memento_ui.py) usano invece il modulo importato
+normalmente come "insert_form" (plugins/ su sys.path, vedi _engine()), così
+piani e cache sono uno solo per processo.
+"""
+
+import os
+import sys
+import sqlite3
+import fnmatch
+from urllib.parse import quote, unquote
+
+from datasette import hookimpl
+from datasette.utils.asgi import Response
+
+# Tabelle FK fino a questa dimensione: tutte le opzioni inline nel form.
+# Oltre: solo le prime FK_INLINE_MAX, il resto via /-/insert/<tabella>/fk/<colonna>.json?q=
+FK_INLINE_MAX = 200
+FK_SEARCH_LIMIT = 20
+
+# {(db_name, tabella): piano}
+_PLANS = {}
+# {(db_name, tabella_fk, colonna_id, colonna_etichetta): (data_version, count, options)}
+_FK_OPTIONS_CACHE = {}
+# connessioni private per PRAGMA data_version/schema_version, {path: conn}
+_VERSION_CONNS = {}
+
+_NUMERIC_TYPES = ("REAL", "FLOA", "DOUB", "NUMERIC", "DECIMAL")
+
+
+def _q(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def _engine():
+    """Il modulo "insert_form" importato da sys.path: quello con piani e cache condivisi."""
+    plugins_dir = os.path.dirname(os.path.abspath(__file__))
+    if plugins_dir not in sys.path:
+        sys.path.append(plugins_dir)
+    import insert_form
+
+    return insert_form
+
+
+def _config_registry():
+    """Il modulo condiviso plugins/config_registry.py (una sola cache per processo)."""
+    plugins_dir = os.path.dirname(os.path.abspath(__file__))
+    if plugins_dir not in sys.path:
+        sys.path.append(plugins_dir)
+    import config_registry
+
+    return config_registry
+
+
+def _pragma(db, name):
+    """
+    PRAGMA data_version / schema_version su una connessione privata, senza
+    passare dal thread di Datasette: data_version cambia a ogni commit di
+    altre connessioni, schema_version a ogni modifica dello schema.
+    """
+    if not db.path:
+        return None
+    conn = _VERSION_CONNS.get(db.path)
+    if conn is None:
+        conn = _VERSION_CONNS[db.path] = sqlite3.connect(db.path, check_same_thread=False)
+    return conn.execute(f"PRAGMA {name}").fetchone()[0]
+
+
+# ---- compilazione del piano -------------------------------------------------
+
+def _is_timestamp(table, column, rules):
+    """timestamp_columns.txt: {pattern_tabella: [pattern_colonna, ...]}, senza maiuscole/minuscole."""
+    t, c = table.lower(), column.lower()
+    for table_pattern, col_patterns in rules.items():
+        if fnmatch.fnmatchcase(t, table_pattern.lower()):
+            if any(fnmatch.fnmatchcase(c, p.lower()) for p in col_patterns):
+                return True
+    return False
+
+
+def _widget(table, name, col_type, rules):
+    t = (col_type or "").upper()
+    if "DATETIME" in t or "TIMESTAMP" in t or _is_timestamp(table, name, rules):
+        return "datetime"
+    if t == "DATE":
+        return "date"
+    if "INT" in t:
+        return "integer"
+    if any(x in t for x in _NUMERIC_TYPES):
+        return "number"
+    return "text"
+
+
+def _label_column(info, key_column):
+    """Prima colonna testuale (affinità TEXT) non PK della tabella referenziata."""
+    for _cid, name, col_type, _notnull, _dflt, pk in info:
+        t = (col_type or "").upper()
+        if not pk and (not t or "CHAR" in t or "CLOB" in t or "TEXT" in t):
+            return name
+    return key_column
+
+
+def _resolve_fk(conn, name, declared, labels):
+    """(tabella, colonna chiave, colonna etichetta) se la colonna è una FK, altrimenti None."""
+    if name in declared:
+        fk_table, fk_column = declared[name]
+    elif name.endswith("_id") and name[:-3] in labels:
+        # convenzione di sex_fk.ini: partner_id -> partner.id
+        fk_table, fk_column = name[:-3], "id"
+    else:
+        return None
+    info = conn.execute(f"PRAGMA table_info({_q(fk_table)})").fetchall()
+    if not info:
+        return None
+    if not fk_column:
+        # REFERENCES tabella senza colonna: la sua PK
+        pks = [r[1] for r in info if r[5]]
+        fk_column = pks[0] if len(pks) == 1 else "rowid"
+    return fk_table, fk_column, labels.get(fk_table) or _label_column(info, fk_column)
+
+
+def _compile_plan(conn, table, labels, rules):
+    """
+    Schema del form + INSERT per una tabella, letti con una sola visita al
+    thread di lettura. None se la tabella non esiste.
+
+    L'INSERT elenca sempre tutte le colonne (tranne la PK INTEGER, cioè il
+    rowid): un campo vuoto vale NULL, oppure il DEFAULT della colonna via
+    coalesce(), così il testo SQL è fisso e lo statement preparato è sempre
+    lo stesso.
+    """
+    version = conn.execute("PRAGMA schema_version").fetchone()[0]
+    info = conn.execute(f"PRAGMA table_info({_q(table)})").fetchall()
+    if not info:
+        return None
+
+    # solo FK su una colonna: id, seq, table, from, to, ...
+    groups = {}
+    for row in conn.execute(f"PRAGMA foreign_key_list({_q(table)})").fetchall():
+        groups.setdefault(row[0], []).append(row)
+    declared = {rows[0][3]: (rows[0][2], rows[0][4]) for rows in groups.values() if len(rows) == 1}
+
+    pks = [r for r in info if r[5]]
+    rowid_alias = len(pks) == 1 and (pks[0][2] or "").upper() == "INTEGER"
+
+    columns = []
+    exprs = []
+    for _cid, name, col_type, notnull, dflt, pk in info:
+        if pk and rowid_alias:
+            continue
+        fk = _resolve_fk(conn, name, declared, labels)
+        columns.append({
+            "name": name,
+            "type": col_type,
+            "pk": bool(pk),
+            "notnull": bool(notnull),
+            "default": dflt,
+            "required": bool(notnull) and dflt is None,
+            "widget": "fk" if fk else _widget(table, name, col_type, rules),
+            "is_fk": bool(fk),
+            "fk_table": fk[0] if fk else None,
+            "fk_column": fk[1] if fk else None,
+            "fk_label": fk[2] if fk else None,
+        })
+        exprs.append("?" if dflt is None else f"coalesce(?, {dflt})")
+
+    sql = None
+    if columns:
+        sql = (
+            f"insert into {_q(table)} ({', '.join(_q(c['name']) for c in columns)}) "
+            f"values ({', '.join(exprs)})"
+        )
+    return {
+        "version": version,
+        "table": table,
+        "columns": columns,
+        "sql": sql,
+        "labels": labels,
+        "rules": rules,
+    }
+
+
+def _is_internal_name(table):
+    # tabelle di servizio dei plugin (__memento_*, ...) e di SQLite
+    return table.startswith("__") or table.lower().startswith("sqlite_")
+
+
+async def get_plan(db, table):
+    """
+    Piano compilato per la tabella, ricompilato solo se cambia lo schema o la config.
+    None se non esiste o è una tabella interna (__*, sqlite_*, tabelle nascoste di Datasette).
+    """
+    if _is_internal_name(table):
+        return None
+    registry = _config_registry()
+    labels = registry.get("sex_fk.ini")
+    rules = registry.get("timestamp_columns.txt")
+    key = (db.name, table)
+    plan = _PLANS.get(key)
+    version = _pragma(db, "schema_version")
+    if (
+        plan
+        and version is not None
+        and plan["version"] == version
+        and plan["labels"] is labels
+        and plan["rules"] is rules
+    ):
+        return plan
+    if table in await db.hidden_table_names():
+        # FTS, spatialite, ...: mai un form di inserimento
+        return None
+    plan = await db.execute_fn(lambda conn: _compile_plan(conn, table, labels, rules))
+    if plan is None:
+        _PLANS.pop(key, None)
+    else:
+        _PLANS[key] = plan
+    return plan
+
+
+def _datetime_value(s):
+    """datetime-local (YYYY-MM-DDTHH:MM[:SS]) -> stringa per SQLite (YYYY-MM-DD HH:MM:SS)."""
+    if "T" not in s:
+        return s
+    day, time = s.split("T", 1)
+    if len(time) == 5:  # HH:MM
+        time += ":00"
+    return f"{day} {time}"
+
+
+def _form_params(plan, form):
+    """Parametri dell'INSERT nell'ordine del piano; None se nessun campo è compilato."""
+    params = []
+    for c in plan["columns"]:
+        v = (form.get(c["name"]) or "").strip()
+        if not v:
+            params.append(None)
+        elif c["widget"] == "datetime":
+            params.append(_datetime_value(v))
+        else:
+            params.append(v)
+    if all(p is None for p in params):
+        return None
+    return params
+
+
+# ---- opzioni FK ---------------------------------------------------------------
+
+def _create_label_indexes(conn, labels):
+    """Indice (etichetta COLLATE NOCASE) per la ricerca per prefisso su ogni tabella FK di sex_fk.ini."""
+    with conn:
+        for fk_table, label in labels.items():
+            if _is_internal_name(fk_table):
+                continue
+            if label not in {r[1] for r in conn.execute(f"PRAGMA table_info({_q(fk_table)})")}:
+                continue
+            conn.execute(
+                f"create index if not exists {_q(f'idx_{fk_table}_{label}_nocase')} "
+                f"on {_q(fk_table)} ({_q(label)} collate nocase)"
+            )
+
+
+async def ensure_label_indexes(db):
+    """
+    Crea gli indici delle etichette FK (vedi sopra); chiamata all'avvio, così
+    le richieste GET non modificano mai lo schema. Una modifica di sex_fk.ini
+    viene indicizzata al riavvio successivo; senza indice la ricerca funziona
+    comunque, solo più lenta.
+    """
+    labels = _config_registry().get("sex_fk.ini")
+    try:
+        await db.execute_write_fn(lambda conn: _create_label_indexes(conn, labels), block=True)
+    except Exception:
+        # db immutabile o in sola lettura
+        pass
+
+
+async def _get_fk_options(db, col):
+    """
+    Ritorna (totale righe, opzioni [{id, label}]) per la tabella FK di una colonna.
+
+    In cache finché PRAGMA data_version non cambia (cioè finché nessuno
+    scrive sul database). Oltre FK_INLINE_MAX righe vengono caricate solo
+    le prime FK_INLINE_MAX per etichetta.
+    """
+    fk_table, fk_column, label = col["fk_table"], col["fk_column"], col["fk_label"]
+    key = (db.name, fk_table, fk_column, label)
+    version = _pragma(db, "data_version")
+    cached = _FK_OPTIONS_CACHE.get(key)
+    if cached and version is not None and cached[0] == version:
+        return cached[1], cached[2]
+
+    count = (await db.execute(f"select count(*) from {_q(fk_table)}")).rows[0][0]
+    res = await db.execute(
+        f"select {_q(fk_column)} as id, {_q(label)} as label from {_q(fk_table)} "
+        f"order by {_q(label)} collate nocase limit {FK_INLINE_MAX}"
+    )
+    options = [{"id": row["id"], "label": row["label"]} for row in res.rows]
+    # la versione letta prima della query: una scrittura nel frattempo invalida al prossimo giro
+    _FK_OPTIONS_CACHE[key] = (version, count, options)
+    return count, options
+
+
+def fk_search_url(datasette, table, column):
+    return datasette.urls.path(
+        "/-/insert/" + quote(table, safe="") + "/fk/" + quote(column, safe="") + ".json"
+    )
+
+
+# ---- view ---------------------------------------------------------------------
+
+async def _build_form_context(datasette, db, plan, message=None):
+    """
+    Contesto per insert_form.html: le colonne del piano, con in più per le FK
+      - options: lista di {id, label} per il dropdown
+      - fk_url: endpoint di ricerca, se le opzioni inline non sono tutte
+    """
+    columns = []
+    for c in plan["columns"]:
+        col = dict(c, options=[], fk_url=None)
+        if c["is_fk"]:
+            try:
+                count, options = await _get_fk_options(db, c)
+            except Exception:
+                # In caso di errore (tabella/colonna mancante) non blocchiamo il form
+                count, options = 0, []
+            col["options"] = options
+            if count > len(options):
+                col["fk_url"] = fk_search_url(datasette, plan["table"], c["name"])
+        columns.append(col)
+    return {
+        "database": db.name,
+        "table": plan["table"],
+        "columns": columns,
+        "message": message,
+        "table_url": datasette.urls.table(db.name, plan["table"]),
+    }
+
+
+async def handle_insert(request, datasette, table):
+    """GET/POST del form di inserimento per una tabella del database di default."""
+    db = datasette.get_database()
+    plan = await get_plan(db, table)
+    if plan is None:
+        return Response.text(f"Tabella sconosciuta: {table}", status=404)
+    message = None
+
+    if request.method == "POST":
+        form = await request.post_vars()
+        params = _form_params(plan, form) if plan["sql"] else None
+        if params is None:
+            message = "Nessun dato da inserire."
+        else:
+            try:
+                await db.execute_write(plan["sql"], params, block=True)
+            except sqlite3.Error as e:
+                message = f"Errore: {e}"
+            else:
+                try:
+                    datasette.add_message(request, f"Record inserito nella tabella {table}.")
+                except Exception:
+                    # anche se fallisce il messaggio, non blocchiamo l'inserimento
+                    pass
+                return Response.redirect(datasette.urls.table(db.name, table))
+
+    context = await _build_form_context(datasette, db, plan, message=message)
+    html = await datasette.render_template("insert_form.html", context, request=request)
+    return Response.html(html)
+
+
+async def handle_fk_search(request, datasette, table, column):
+    """
+    Prime N righe {id, label} della tabella FK di table.column la cui
+    etichetta inizia con q, senza distinzione maiuscole/minuscole; usa
+    l'indice NOCASE sull'etichetta creato all'avvio (ensure_label_indexes).
+    """
+    db = datasette.get_database()
+    plan = await get_plan(db, table)
+    col = next((c for c in plan["columns"] if c["name"] == column and c["is_fk"]), None) if plan else None
+    if col is None:
+        return Response.json({"ok": False, "error": f"Colonna FK sconosciuta: {table}.{column}"}, status=404)
+    try:
+        limit = min(max(int(request.args.get("limit", FK_SEARCH_LIMIT)), 1), FK_INLINE_MAX)
+    except ValueError:
+        limit = FK_SEARCH_LIMIT
+    q = request.args.get("q") or ""
+
+    fk_table, label = col["fk_table"], col["fk_label"]
+    # prefisso come pattern LIKE letterale: il bind permette all'indice NOCASE di fare un range scan
+    pattern = q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+    try:
+        res = await db.execute(
+            f"select {_q(col['fk_column'])} as id, {_q(label)} as label from {_q(fk_table)} "
+            f"where {_q(label)} like :p escape '\\' "
+            f"order by {_q(label)} collate nocase limit {limit}",
+            {"p": pattern},
+        )
+    except Exception as e:
+        return Response.json({"ok": False, "error": str(e)}, status=400)
+    return Response.json({
+        "ok": True,
+        "rows": [{"id": row["id"], "label": row["label"]} for row in res.rows],
+    })
+
+
+async def insert_view(request, datasette):
+    """GET/POST /-/insert/<tabella>"""
+    return await handle_insert(request, datasette, unquote(request.url_vars["table"]))
+
+
+async def fk_search_view(request, datasette):
+    """GET /-/insert/<tabella>/fk/<colonna>.json?q=<prefisso>&limit=N"""
+    return await handle_fk_search(
+        request, datasette, unquote(request.url_vars["table"]), unquote(request.url_vars["column"])
+    )
+
+
+@hookimpl
+def startup(datasette):
+    async def inner():
+        db = datasette.get_database()
+        if db.is_mutable:
+            await _engine().ensure_label_indexes(db)
+
+    return inner
+
+
+@hookimpl
+def register_routes():
+    engine = _engine()
+    return [
+        (r"^/-/insert/(?P<table>[^/]+)$", engine.insert_view),
+        (r"^/-/insert/(?P<table>[^/]+)/fk/(?P<column>[^/]+)\.json$", engine.fk_search_view),
+    ]
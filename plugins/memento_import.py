@@ -0,0 +1,1525 @@
+# -*- coding: utf-8 -*-
+# plugins/memento_import.py
+"""
+CSV -> SQLite import pipeline of memento_ui: type inference, conversion,
+incremental (delta) imports and the parallel prepare/apply split.
+
+A plain module (no Datasette hooks) so process-pool workers can import it
+by name: memento_ui puts plugins/ on sys.path and imports it as
+"memento_import"; spawned workers inherit that sys.path.
+"""
+
+import os
+import io
+import sys
+import csv
+import pathlib
+import logging
+import concurrent.futures
+import multiprocessing
+import re
+import hashlib
+import sqlite3
+import time
+import math
+import pickle
+import tempfile
+import random
+import itertools
+from datetime import datetime, date
+
+log = logging.getLogger("memento")
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CSV_DIR = os.path.join(BASE_DIR, "memento_csvs")
+
+# ---- overrides: columns that must NOT be treated as booleans ------------------
+
+# (parsed registry data, lowercased overrides built from it)
+_NON_BOOL_CACHE = None
+
+def _config_registry():
+    """The shared plugins/config_registry.py module (one cache per process, pool workers included)."""
+    plugins_dir = os.path.dirname(os.path.abspath(__file__))
+    if plugins_dir not in sys.path:
+        sys.path.append(plugins_dir)
+    import config_registry
+
+    return config_registry
+
+def _load_non_boolean_overrides() -> dict:
+    """not_booleans.txt via the config registry (BASE_DIR first, then static/custom).
+
+    Format (one per line):
+        table_name: col1, col2, col3
+
+    Returns:
+        {table_name_lower: {colname_lower, ...}, ...}
+    Rebuilt only when the registry re-parses the file (mtime/size change).
+    """
+    global _NON_BOOL_CACHE
+    data = _config_registry().get("not_booleans.txt")
+    if _NON_BOOL_CACHE is None or _NON_BOOL_CACHE[0] is not data:
+        overrides = {
+            t.strip().lower(): {c.lower() for c in cols}
+            for t, cols in data.items()
+            if t.strip()
+        }
+        _NON_BOOL_CACHE = (data, overrides)
+    return _NON_BOOL_CACHE[1]
+
+def _is_forced_non_boolean(table_name: str, colname: str) -> bool:
+    if not table_name or not colname:
+        return False
+    ov = _load_non_boolean_overrides()
+    tn = table_name.strip().lower()
+    cn = colname.strip().lower()
+    return (tn in ov) and (cn in ov[tn])
+
+# ---- util: quoting identifiers ------------------------------------------------
+
+def _q(ident: str) -> str:
+    # Quote SQLite identifier with double quotes
+    return '"' + ident.replace('"', '""') + '"'
+
+# ---- type inference -----------------------------------------------------------
+
+_BOOL_TRUE = {"1", "true", "t", "yes", "y", "on"}
+_BOOL_FALSE = {"0", "false", "f", "no", "n", "off"}
+
+_DURATION_RE = re.compile(r"^\s*(\d{1,3})\s*:\s*(\d{2})\s*$")
+
+_DATE_FORMATS = (
+    "%Y-%m-%d",
+    "%d/%m/%Y",
+    "%Y/%m/%d",
+    "%m/%d/%y",
+    "%m/%d/%Y",
+    "%m-%d-%y",
+    "%m-%d-%Y",
+)
+_DATETIME_FORMATS = (
+    "%Y-%m-%d %H:%M",
+    "%Y-%m-%d %H:%M:%S",
+    "%Y-%m-%dT%H:%M",
+    "%Y-%m-%dT%H:%M:%S",
+    "%Y-%m-%dT%H:%M:%S.%f",
+    "%m/%d/%y %H:%M",
+    "%m/%d/%Y %H:%M",
+    "%m/%d/%y %H:%M:%S",
+    "%m/%d/%Y %H:%M:%S",
+    "%m-%d-%y %H:%M",
+    "%m-%d-%Y %H:%M",
+    "%m-%d-%y %H:%M:%S",
+    "%m-%d-%Y %H:%M:%S",
+)
+def _strptime_prefilter(fmt: str):
+    """Compile a cheap regex that accepts (at least) what strptime(fmt) accepts.
+
+    Values that do not match can skip the strptime call (and its exception).
+    """
+    directives = {
+        "Y": r"\d{4}",
+        "y": r"\d{2}",
+        "f": r"\d{1,6}",
+    }
+    out = []
+    i = 0
+    while i < len(fmt):
+        ch = fmt[i]
+        if ch == "%" and i + 1 < len(fmt):
+            out.append(directives.get(fmt[i + 1], r" ?\d{1,2}"))
+            i += 2
+        elif ch.isspace():
+            out.append(r"\s+")
+            i += 1
+        else:
+            out.append(re.escape(ch))
+            i += 1
+    return re.compile("^" + "".join(out) + "$")
+
+_DATE_PATTERNS = tuple((fmt, _strptime_prefilter(fmt)) for fmt in _DATE_FORMATS)
+_DATETIME_PATTERNS = tuple((fmt, _strptime_prefilter(fmt)) for fmt in _DATETIME_FORMATS)
+
+# every form accepted by date/datetime.fromisoformat starts with a 4-digit year
+_ISO_PREFIX_RE = re.compile(r"^\d{4}")
+_INT_RE = re.compile(r"^[+-]?\d+$")
+
+def _strptime_first(x: str, patterns, start: int = 0):
+    """Return (index, datetime) for the first pattern at/after start that parses x."""
+    for i in range(start, len(patterns)):
+        fmt, rx = patterns[i]
+        if rx.match(x):
+            try:
+                return i, datetime.strptime(x, fmt)
+            except ValueError:
+                continue
+    return None, None
+
+def _iso_date(x: str):
+    if not _ISO_PREFIX_RE.match(x):
+        return None
+    try:
+        # fromisoformat accepts YYYY-MM-DD
+        return date.fromisoformat(x)
+    except Exception:
+        return None
+
+def _iso_datetime(x: str):
+    if not _ISO_PREFIX_RE.match(x):
+        return None
+    try:
+        # normalize 'Z' -> +00:00 (keep as aware, but we'll store ISO)
+        if x.endswith("Z"):
+            return datetime.fromisoformat(x[:-1] + "+00:00")
+        return datetime.fromisoformat(x)
+    except Exception:
+        return None
+
+def _try_parse_bool(s: str):
+    x = s.strip().lower()
+    if x in _BOOL_TRUE:
+        return 1
+    if x in _BOOL_FALSE:
+        return 0
+    return None
+
+def _try_parse_int(s: str):
+    x = s.strip()
+    if x == "":
+        return None
+    if _INT_RE.match(x):
+        return int(x)
+    return None
+
+def _try_parse_float(s: str):
+    x = s.strip()
+    if x == "":
+        return None
+    try:
+        # accept comma decimals too
+        x2 = x.replace(",", ".")
+        return float(x2)
+    except Exception:
+        return None
+
+def _try_parse_date(s: str):
+    x = s.strip()
+    if x == "":
+        return None
+    # ISO date first
+    d = _iso_date(x)
+    if d is not None:
+        return d
+    _, dt = _strptime_first(x, _DATE_PATTERNS)
+    return dt.date() if dt is not None else None
+
+def _try_parse_datetime(s: str):
+    x = s.strip()
+    if x == "":
+        return None
+    # ISO first (supports "YYYY-MM-DDTHH:MM:SS(.fff)" and "YYYY-MM-DD HH:MM:SS")
+    dt = _iso_datetime(x)
+    if dt is not None:
+        return dt
+    _, dt = _strptime_first(x, _DATETIME_PATTERNS)
+    return dt
+
+def _try_parse_duration_hhmm(s: str):
+    m = _DURATION_RE.match(s or "")
+    if not m:
+        return None
+    hh = int(m.group(1))
+    mm = int(m.group(2))
+    if 0 <= mm <= 59:
+        return hh, mm
+    return None
+
+
+def _guess_widget_from_name(colname: str):
+    n = (colname or "").strip().lower()
+    if not n:
+        return None
+    # datetime-ish
+    datetime_tokens = ["datetime", "timestamp", "quando", "ora", "orario", "time", "created", "updated", "modified", "at"]
+    date_tokens = ["date", "data", "giorno", "day"]
+    # prioritize datetime tokens
+    if any(tok in n for tok in datetime_tokens):
+        return ("datetime", "datetime")
+    if any(tok in n for tok in date_tokens):
+        return ("date", "date")
+    return None
+
+class _FormatLock:
+    """Date/datetime classifier for one column that locks onto a format.
+
+    The last format that parsed a value is tried first; only when it fails
+    does the lock fall back to the full (regex-prefiltered) format list and
+    re-lock on whatever matches.
+    """
+
+    __slots__ = ("patterns", "iso", "locked")
+
+    _ISO = -1
+
+    def __init__(self, patterns, iso):
+        self.patterns = patterns
+        self.iso = iso
+        self.locked = None
+
+    def _try(self, x: str, i: int) -> bool:
+        if i == self._ISO:
+            return self.iso(x) is not None
+        fmt, rx = self.patterns[i]
+        if not rx.match(x):
+            return False
+        try:
+            datetime.strptime(x, fmt)
+            return True
+        except ValueError:
+            return False
+
+    def match(self, x: str) -> bool:
+        if self.locked is not None and self._try(x, self.locked):
+            return True
+        if self.iso(x) is not None:
+            self.locked = self._ISO
+            return True
+        i, _ = _strptime_first(x, self.patterns)
+        if i is not None:
+            self.locked = i
+            return True
+        return False
+
+    @property
+    def format(self):
+        if self.locked is None:
+            return None
+        if self.locked == self._ISO:
+            return "iso"
+        return self.patterns[self.locked][0]
+
+
+class _ColumnInference:
+    """Per-column counters for infer_schema_from_csv, with timing."""
+
+    __slots__ = ("nonempty", "bool_ok", "int_ok", "float_ok", "date_ok",
+                 "datetime_ok", "duration_ok", "date_lock", "datetime_lock", "seconds")
+
+    def __init__(self):
+        self.nonempty = 0
+        self.bool_ok = 0
+        self.int_ok = 0
+        self.float_ok = 0
+        self.date_ok = 0
+        self.datetime_ok = 0
+        self.duration_ok = 0
+        self.date_lock = _FormatLock(_DATE_PATTERNS, _iso_date)
+        self.datetime_lock = _FormatLock(_DATETIME_PATTERNS, _iso_datetime)
+        self.seconds = 0.0
+
+    def observe(self, s: str):
+        t0 = time.perf_counter()
+        x = s.strip()
+        self.nonempty += 1
+        lx = x.lower()
+        if lx in _BOOL_TRUE or lx in _BOOL_FALSE:
+            self.bool_ok += 1
+        if _INT_RE.match(x):
+            self.int_ok += 1
+        if _try_parse_float(x) is not None:
+            self.float_ok += 1
+        if self.date_lock.match(x):
+            self.date_ok += 1
+        if self.datetime_lock.match(x):
+            self.datetime_ok += 1
+        if _try_parse_duration_hhmm(x) is not None:
+            self.duration_ok += 1
+        self.seconds += time.perf_counter() - t0
+
+    def ratio(self, k: str) -> float:
+        n = self.nonempty
+        return (getattr(self, k) / n) if n else 0.0
+
+
+# Ratio thresholds of the classification cascade below, in decision order
+_STRONG_RATIO = 0.95
+_WEAK_RATIO = 0.80
+_INFERENCE_RULES = (
+    ("bool_ok", _STRONG_RATIO),
+    ("int_ok", _STRONG_RATIO),
+    ("float_ok", _STRONG_RATIO),
+    ("datetime_ok", _WEAK_RATIO),
+    ("date_ok", _WEAK_RATIO),
+    ("duration_ok", _WEAK_RATIO),
+)
+
+# Inference classifies a uniform sample of this many rows of the whole file,
+# stopping early once every column's classification is statistically settled.
+INFERENCE_SAMPLE_ROWS = 5000
+
+# z-score of the confidence bounds used to call a column settled (~99%)
+_SETTLE_Z = 2.576
+# columns filled in less often than this (upper bound) do not hold up early stopping
+_SPARSE_RATE = 0.01
+_SETTLE_MIN_ROWS = 100
+_SETTLE_EVERY = 50
+
+def _wilson_bounds(k: int, n: int, z: float = _SETTLE_Z):
+    if n <= 0:
+        return 0.0, 1.0
+    p = k / n
+    z2 = z * z
+    denom = 1 + z2 / n
+    centre = p + z2 / (2 * n)
+    margin = z * math.sqrt(p * (1 - p) / n + z2 / (4 * n * n))
+    return max(0.0, (centre - margin) / denom), min(1.0, (centre + margin) / denom)
+
+def _column_settled(st, rows: int, allow_bool: bool) -> bool:
+    """True when more samples are very unlikely to change the column's class.
+
+    Walks the cascade: each rule must be confidently above its threshold
+    (it decides, done) or confidently below (move on); anything in between
+    is still open. Columns that are almost always empty count as settled.
+    """
+    n = st.nonempty
+    if n < _SETTLE_MIN_ROWS:
+        return _wilson_bounds(n, rows)[1] < _SPARSE_RATE
+    for key, threshold in _INFERENCE_RULES:
+        if key == "bool_ok" and not allow_bool:
+            continue
+        lo, hi = _wilson_bounds(getattr(st, key), n)
+        if lo >= threshold:
+            return True
+        if hi >= threshold:
+            return False
+    return True
+
+def _reservoir_sample(rows, k: int, rng: random.Random):
+    """Uniform sample of k non-empty rows from the whole stream (Algorithm R), shuffled."""
+    sample = []
+    seen = 0
+    for row in rows:
+        if not row:
+            continue
+        if seen < k:
+            sample.append(row)
+        else:
+            j = rng.randrange(seen + 1)
+            if j < k:
+                sample[j] = row
+        seen += 1
+    rng.shuffle(sample)
+    return sample
+
+def _classify_rows(fieldnames, rows, stats, early_stop: bool = False, table_name: str = None) -> int:
+    """Feed rows into the per-column counters; returns the number of rows examined."""
+    # last index wins for duplicated header names, like csv.DictReader
+    index = {c: i for i, c in enumerate(fieldnames)}
+    slots = [(i, stats[c]) for c, i in index.items()]
+    allow_bool = {c: not _is_forced_non_boolean(table_name or "", c) for c in index}
+    open_cols = set(index)
+
+    rows_seen = 0
+    for row in rows:
+        if not row:
+            continue
+        rows_seen += 1
+        width = len(row)
+        for i, st in slots:
+            if i >= width:
+                continue
+            s = row[i]
+            if not s or s.isspace():
+                continue
+            st.observe(s)
+        if early_stop and rows_seen >= _SETTLE_MIN_ROWS and rows_seen % _SETTLE_EVERY == 0:
+            open_cols = {c for c in open_cols if not _column_settled(stats[c], rows_seen, allow_bool[c])}
+            if not open_cols:
+                break
+    return rows_seen
+
+def infer_schema_from_csv(csv_path: str, table_name: str = None, sample_rows: int = INFERENCE_SAMPLE_ROWS):
+    """
+    Returns:
+        columns: list of dict: {name, sql_type, widget, subtype, format, infer_seconds, infer_rows}
+
+    ``format`` is the date/datetime format the column locked onto (or None),
+    ``infer_seconds`` the time spent classifying that column's values and
+    ``infer_rows`` how many rows were classified. The sample is drawn
+    uniformly from the whole file, so a change of format past its head is
+    seen; the shuffled sample is classified only until every column is
+    settled (Wilson bounds, see _column_settled).
+    """
+    with open(csv_path, "r", encoding="utf-8-sig", newline="") as f:
+        reader = csv.reader(f)
+        fieldnames = next(reader, None) or []
+        stats = {c: _ColumnInference() for c in fieldnames}
+        # seeded, so re-importing the same file infers the same schema
+        sample = _reservoir_sample(reader, sample_rows, random.Random(0))
+        rows_used = _classify_rows(fieldnames, sample, stats, early_stop=True, table_name=table_name)
+    return _decide_columns(fieldnames, stats, table_name, rows_used)
+
+def _decide_columns(fieldnames, stats, table_name: str, rows_used: int):
+    columns = []
+    for c in fieldnames:
+        st = stats[c]
+        n = st.nonempty
+        ratio = st.ratio
+        fmt = None
+
+        # Decide based on strong ratios
+        # If column is explicitly marked as non-boolean, never pick the checkbox widget.
+        if n and n >= 10 and ratio("bool_ok") >= _STRONG_RATIO and not _is_forced_non_boolean(table_name or "", c):
+            sql_type = "INTEGER"
+            widget = "checkbox"
+            subtype = "boolean"
+        elif n and ratio("int_ok") >= _STRONG_RATIO:
+            sql_type = "INTEGER"
+            widget = "number"
+            subtype = "integer"
+        elif n and ratio("float_ok") >= _STRONG_RATIO:
+            sql_type = "REAL"
+            widget = "number"
+            subtype = "float"
+        elif n and ratio("datetime_ok") >= _WEAK_RATIO:
+            sql_type = "TEXT"
+            widget = "datetime"
+            subtype = "datetime"
+            fmt = st.datetime_lock.format
+        elif n and ratio("date_ok") >= _WEAK_RATIO:
+            sql_type = "TEXT"
+            widget = "date"
+            subtype = "date"
+            fmt = st.date_lock.format
+        elif n and ratio("duration_ok") >= _WEAK_RATIO:
+            sql_type = "TEXT"
+            widget = "duration_hhmm"
+            subtype = "duration_hhmm"
+        else:
+            sql_type = "TEXT"
+            widget = "text"
+            subtype = "text"
+        # Name-based fallback for date/datetime when values are empty or inconclusive
+        if widget == "text":
+            g = _guess_widget_from_name(c)
+            if g:
+                widget, subtype = g
+                sql_type = "TEXT"
+
+        columns.append({
+            "name": c,
+            "sql_type": sql_type,
+            "widget": widget,
+            "subtype": subtype,
+            "format": fmt,
+            "infer_seconds": st.seconds,
+            "infer_rows": rows_used,
+        })
+
+    return columns
+
+# ---- import -------------------------------------------------------------------
+
+def _sha256_file(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def _sha256_update(hasher, path: str, start: int, end: int) -> int:
+    """Feed bytes [start, end) of path into hasher; returns how many were read (fewer if the file is shorter)."""
+    read = 0
+    with open(path, "rb") as f:
+        f.seek(start)
+        while start + read < end:
+            chunk = f.read(min(end - start - read, 1024 * 1024))
+            if not chunk:
+                break
+            hasher.update(chunk)
+            read += len(chunk)
+    return read
+
+# columns added to __memento_import_state after its first release
+_STATE_EXTRA_COLUMNS = (
+    ("byte_offset", "INTEGER"),
+    ("file_size", "INTEGER"),
+    ("mtime_ns", "INTEGER"),
+    ("inode", "INTEGER"),
+)
+
+# columns added to __memento_column_meta after its first release: "format"
+# is the date/datetime format the importer locked onto ("iso" or a strptime
+# pattern), so exports write dates back the way the CSV had them
+_COLUMN_META_EXTRA_COLUMNS = (
+    ("format", "TEXT"),
+)
+
+def _ensure_extra_columns(conn: sqlite3.Connection, table: str, columns):
+    have = {r[1] for r in conn.execute(f"PRAGMA table_info({_q(table)})")}
+    for name, decl in columns:
+        if name not in have:
+            conn.execute(f"ALTER TABLE {_q(table)} ADD COLUMN {_q(name)} {decl}")
+
+def ensure_memento_meta_tables(conn: sqlite3.Connection):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS "__memento_summary" (
+            table_name TEXT PRIMARY KEY,
+            ts_column TEXT,
+            n INTEGER NOT NULL DEFAULT 0,
+            min_ts TEXT,
+            max_ts TEXT,
+            last_rowid INTEGER
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS "__memento_import_state" (
+            csv_name TEXT PRIMARY KEY,
+            table_name TEXT NOT NULL,
+            sha256 TEXT NOT NULL,
+            imported_at TEXT NOT NULL
+        )
+    """)
+    _ensure_extra_columns(conn, "__memento_import_state", _STATE_EXTRA_COLUMNS)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS "__memento_row_index" (
+            csv_name TEXT NOT NULL,
+            fingerprint TEXT NOT NULL,
+            n INTEGER NOT NULL,
+            PRIMARY KEY (csv_name, fingerprint)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS "__memento_column_meta" (
+            table_name TEXT NOT NULL,
+            column_name TEXT NOT NULL,
+            widget TEXT NOT NULL,
+            subtype TEXT,
+            PRIMARY KEY (table_name, column_name)
+        )
+    """)
+    _ensure_extra_columns(conn, "__memento_column_meta", _COLUMN_META_EXTRA_COLUMNS)
+
+def table_exists(conn: sqlite3.Connection, table_name: str) -> bool:
+    cur = conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name = ?", (table_name,))
+    return cur.fetchone() is not None
+
+# ---- per-table summary (kept current by triggers) ------------------------------
+
+def _lit(value: str) -> str:
+    # Quote a SQL string literal (trigger bodies cannot take parameters)
+    return "'" + value.replace("'", "''") + "'"
+
+def _summary_ts_column(conn: sqlite3.Connection, table_name: str):
+    """The column summarised as min/max timestamp: first datetime, else first date column.
+
+    Only columns whose values were parsed (a recorded format) are stored as
+    ISO and compare chronologically; a subtype guessed from the column name
+    alone holds the raw strings, so such a table gets NULL bounds instead.
+    """
+    subtypes = {
+        name: subtype
+        for name, subtype, fmt in conn.execute(
+            'SELECT column_name, subtype, format FROM "__memento_column_meta" WHERE table_name = ?', (table_name,)
+        )
+        if fmt
+    }
+    names = [r[1] for r in conn.execute(f"PRAGMA table_info({_q(table_name)})")]
+    for wanted in ("datetime", "date"):
+        for name in names:
+            if subtypes.get(name) == wanted:
+                return name
+    return None
+
+def _summary_trigger_sql(table_name: str, ts_col):
+    t, key = _q(table_name), _lit(table_name)
+    names = {op: _q(f"__memento_summary_{op}:{table_name}") for op in ("ai", "ad", "au")}
+    ins_ts = del_ts = ""
+    if ts_col:
+        c = _q(ts_col)
+        ins_ts = (
+            f", min_ts = CASE WHEN NEW.{c} IS NOT NULL AND (min_ts IS NULL OR NEW.{c} < min_ts) THEN NEW.{c} ELSE min_ts END"
+            f", max_ts = CASE WHEN NEW.{c} IS NOT NULL AND (max_ts IS NULL OR NEW.{c} > max_ts) THEN NEW.{c} ELSE max_ts END"
+        )
+        # only removing the current min/max needs a lookup, answered by the
+        # ts index (see ensure_table_summary) instead of a table scan
+        del_ts = (
+            f", min_ts = CASE WHEN OLD.{c} = min_ts THEN (SELECT min({c}) FROM {t}) ELSE min_ts END"
+            f", max_ts = CASE WHEN OLD.{c} = max_ts THEN (SELECT max({c}) FROM {t}) ELSE max_ts END"
+        )
+    stmts = [
+        f"""CREATE TRIGGER {names["ai"]} AFTER INSERT ON {t} BEGIN
+            UPDATE "__memento_summary" SET n = n + 1, last_rowid = NEW.rowid{ins_ts}
+            WHERE table_name = {key};
+        END""",
+        f"""CREATE TRIGGER {names["ad"]} AFTER DELETE ON {t} BEGIN
+            UPDATE "__memento_summary" SET n = n - 1,
+                last_rowid = CASE WHEN OLD.rowid = last_rowid THEN (SELECT max(rowid) FROM {t}) ELSE last_rowid END{del_ts}
+            WHERE table_name = {key};
+        END""",
+    ]
+    if ts_col:
+        c = _q(ts_col)
+        stmts.append(
+            f"""CREATE TRIGGER {names["au"]} AFTER UPDATE OF {c} ON {t} BEGIN
+                UPDATE "__memento_summary" SET
+                    min_ts = CASE WHEN OLD.{c} = min_ts THEN (SELECT min({c}) FROM {t})
+                        WHEN NEW.{c} IS NOT NULL AND (min_ts IS NULL OR NEW.{c} < min_ts) THEN NEW.{c} ELSE min_ts END,
+                    max_ts = CASE WHEN OLD.{c} = max_ts THEN (SELECT max({c}) FROM {t})
+                        WHEN NEW.{c} IS NOT NULL AND (max_ts IS NULL OR NEW.{c} > max_ts) THEN NEW.{c} ELSE max_ts END
+                WHERE table_name = {key};
+            END"""
+        )
+    return names, stmts
+
+def ensure_table_summary(conn: sqlite3.Connection, table_name: str):
+    """Install the summary triggers on table_name and backfill its summary row.
+
+    The timestamp column gets an index, so the triggers recompute a removed
+    min/max with an index lookup. No-op when the triggers and index exist and
+    were built for the current timestamp column; otherwise they are
+    recreated and the row recomputed once.
+    """
+    if not table_exists(conn, table_name):
+        return
+    ts_col = _summary_ts_column(conn, table_name)
+    names, stmts = _summary_trigger_sql(table_name, ts_col)
+    ts_index = f"__memento_ts:{table_name}"
+    row = conn.execute('SELECT ts_column FROM "__memento_summary" WHERE table_name = ?', (table_name,)).fetchone()
+    have = {r[0] for r in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type IN ('trigger', 'index') AND tbl_name = ?", (table_name,)
+    )}
+    wanted = {n[1:-1].replace('""', '"') for n in names.values()}
+    if ts_col:
+        wanted.add(ts_index)
+    else:
+        wanted.discard(f"__memento_summary_au:{table_name}")
+    if row and row[0] == ts_col and wanted <= have:
+        return
+    with _transaction(conn):
+        for n in names.values():
+            conn.execute(f"DROP TRIGGER IF EXISTS {n}")
+        conn.execute(f"DROP INDEX IF EXISTS {_q(ts_index)}")
+        if ts_col:
+            conn.execute(f"CREATE INDEX {_q(ts_index)} ON {_q(table_name)}({_q(ts_col)})")
+        for sql in stmts:
+            conn.execute(sql)
+        ts = _q(ts_col) if ts_col else "NULL"
+        conn.execute(
+            f'INSERT OR REPLACE INTO "__memento_summary"(table_name, ts_column, n, min_ts, max_ts, last_rowid) '
+            f"SELECT ?, ?, count(*), min({ts}), max({ts}), max(rowid) FROM {_q(table_name)}",
+            (table_name, ts_col),
+        )
+
+IMPORT_CHUNK_ROWS = 5000
+
+# On a changed CSV, insert only its new rows instead of ignoring the change
+INCREMENTAL_IMPORT = True
+
+# Create new tables hashing the CSV while it is loaded, instead of in a read
+# of its own: one read samples it for inference, the next streams it into
+# the table while hashing
+ONE_PASS_IMPORT = True
+
+
+class _transaction:
+    """Explicit transaction around a block of statements.
+
+    Opens BEGIN/COMMIT when the connection is idle, otherwise nests as a
+    SAVEPOINT so callers that already hold a transaction keep control of it.
+    """
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+        self.nested = False
+
+    def __enter__(self):
+        self.nested = self.conn.in_transaction
+        if self.nested:
+            self.conn.execute('SAVEPOINT "memento_tx"')
+        else:
+            self.conn.execute("BEGIN")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.nested:
+            if exc_type is not None:
+                self.conn.execute('ROLLBACK TO SAVEPOINT "memento_tx"')
+            self.conn.execute('RELEASE SAVEPOINT "memento_tx"')
+        elif exc_type is not None:
+            self.conn.rollback()
+        else:
+            self.conn.commit()
+        return False
+
+
+def _convert_text(s: str):
+    return s
+
+def _convert_boolean(s: str):
+    return _try_parse_bool(s)
+
+def _convert_integer(s: str):
+    iv = _try_parse_int(s)
+    return iv if iv is not None else s
+
+def _convert_float(s: str):
+    fv = _try_parse_float(s)
+    return fv if fv is not None else s
+
+def _convert_date(s: str):
+    dv = _try_parse_date(s)
+    return dv.isoformat() if dv else s
+
+def _convert_datetime(s: str):
+    dt = _try_parse_datetime(s)
+    return dt.isoformat() if dt else s
+
+def _convert_duration_hhmm(s: str):
+    # keep canonical HH:MM
+    d = _try_parse_duration_hhmm(s)
+    return f"{d[0]}:{d[1]:02d}" if d else s
+
+_CONVERTERS = {
+    "boolean": _convert_boolean,
+    "integer": _convert_integer,
+    "float": _convert_float,
+    "date": _convert_date,
+    "datetime": _convert_datetime,
+    "duration_hhmm": _convert_duration_hhmm,
+}
+
+def _compile_row_converter(fieldnames, columns):
+    """Build a function mapping a csv.reader row (list) to INSERT values.
+
+    Each column's converter is resolved once from the inferred subtype, so
+    the per-cell work is a strip plus one direct call.
+    """
+    by_name = {c["name"]: c for c in columns}
+    converters = tuple(
+        _CONVERTERS.get((by_name.get(c) or {}).get("subtype"), _convert_text)
+        for c in fieldnames
+    )
+    width = len(converters)
+
+    def convert(row):
+        if len(row) < width:
+            row = row + [""] * (width - len(row))
+        vals = []
+        for conv, v in zip(converters, row):
+            s = v.strip() if v else ""
+            vals.append(conv(s) if s else None)
+        return vals
+
+    return convert
+
+def _iter_chunks(rows, size: int):
+    chunk = []
+    for r in rows:
+        chunk.append(r)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _row_fingerprint(row) -> str:
+    return hashlib.blake2b(
+        "\x1f".join(v.strip() for v in row).encode("utf-8"), digest_size=16
+    ).hexdigest()
+
+def _iter_row_index(conn: sqlite3.Connection, csv_name: str):
+    return conn.execute('SELECT fingerprint, n FROM "__memento_row_index" WHERE csv_name = ?', (csv_name,))
+
+class _FingerprintCounts:
+    """Occurrence counts of row fingerprints, kept in a scratch SQLite database.
+
+    ``known`` is an iterable of (fingerprint, n) loaded once; take() then
+    walks a file's rows chunk by chunk and tells which ones are not covered
+    by those counts. Only one chunk's counts are held in memory, however
+    many rows the file has (the scratch database spills to a temp file).
+    """
+
+    _BATCH = 500
+
+    def __init__(self, known=()):
+        self._conn = sqlite3.connect("")
+        self._conn.execute(
+            "CREATE TABLE counts(fp TEXT PRIMARY KEY, known INTEGER NOT NULL, seen INTEGER NOT NULL DEFAULT 0) WITHOUT ROWID"
+        )
+        self._conn.executemany(
+            "INSERT INTO counts(fp, known) VALUES (?, ?) ON CONFLICT(fp) DO UPDATE SET known = known + excluded.known",
+            known,
+        )
+
+    def take(self, fps):
+        """[is new] for each fingerprint of fps, in order, counting each as seen.
+
+        Identical rows are matched by occurrence: the (n+1)-th copy of a
+        fingerprint known n times is new.
+        """
+        distinct = list(set(fps))
+        counts = {}
+        for i in range(0, len(distinct), self._BATCH):
+            batch = distinct[i:i + self._BATCH]
+            cur = self._conn.execute(
+                f"SELECT fp, known, seen FROM counts WHERE fp IN ({', '.join('?' * len(batch))})", batch
+            )
+            counts.update((fp, [known, seen]) for fp, known, seen in cur)
+        new = []
+        for fp in fps:
+            c = counts.setdefault(fp, [0, 0])
+            new.append(c[1] >= c[0])
+            c[1] += 1
+        self._conn.executemany(
+            "INSERT INTO counts(fp, known, seen) VALUES (?, ?, ?) ON CONFLICT(fp) DO UPDATE SET seen = excluded.seen",
+            [(fp, known, seen) for fp, (known, seen) in counts.items()],
+        )
+        return new
+
+    def close(self):
+        self._conn.close()
+
+def _store_row_index(conn: sqlite3.Connection, csv_name: str, added: dict):
+    conn.executemany(
+        'INSERT INTO "__memento_row_index"(csv_name, fingerprint, n) VALUES (?, ?, ?) '
+        'ON CONFLICT(csv_name, fingerprint) DO UPDATE SET n = n + excluded.n',
+        [(csv_name, fp, n) for fp, n in added.items()],
+    )
+
+def _row_mapper(table_name, fieldnames, columns):
+    """Return (insert_sql, mapper) for loading csv rows into table_name.
+
+    Only columns present in ``columns`` are written; mapper turns a raw csv
+    row into the INSERT values. insert_sql is None if nothing would be written.
+    """
+    known = {c["name"] for c in columns}
+    targets = [(i, c) for i, c in enumerate(fieldnames) if c in known]
+    if not targets:
+        return None, None
+    names = [c for _, c in targets]
+    idx = [i for i, _ in targets]
+    placeholders = ", ".join(["?"] * len(names))
+    insert_sql = f'INSERT INTO {_q(table_name)} ({", ".join(_q(c) for c in names)}) VALUES ({placeholders})'
+    convert = _compile_row_converter(names, columns)
+    if idx == list(range(len(fieldnames))):
+        return insert_sql, convert
+
+    def mapper(row):
+        width = len(row)
+        return convert([row[i] if i < width else "" for i in idx])
+
+    return insert_sql, mapper
+
+def _convert_csv_rows(rows, mapper, chunk_rows, indexed=None):
+    """Yield (values, fingerprints, mark) for each chunk of up to chunk_rows csv rows.
+
+    ``values`` are the converted rows to insert and ``fingerprints`` their
+    {fingerprint: n} increments for __memento_row_index; ``mark`` is None
+    here (see _convert_csv_tail). With ``indexed``
+    (a _FingerprintCounts of the rows already imported) rows it covers are
+    skipped. Nothing outlives its chunk, so memory does not grow with the file.
+    """
+    try:
+        for chunk in _iter_chunks((r for r in rows if r), chunk_rows):
+            fps = [_row_fingerprint(r) for r in chunk]
+            new = indexed.take(fps) if indexed is not None else itertools.repeat(True)
+            values, added = [], {}
+            for row, fp, is_new in zip(chunk, fps, new):
+                if is_new:
+                    values.append(mapper(row))
+                    added[fp] = added.get(fp, 0) + 1
+            yield values, added, None
+    finally:
+        if indexed is not None:
+            indexed.close()
+
+def _fingerprint_chunks(rows, chunk_rows):
+    """Like _convert_csv_rows, but only index the rows: yields ([], fingerprints, None)."""
+    for chunk in _iter_chunks((r for r in rows if r), chunk_rows):
+        added = {}
+        for row in chunk:
+            fp = _row_fingerprint(row)
+            added[fp] = added.get(fp, 0) + 1
+        yield [], added, None
+
+def _value_key(values) -> str:
+    """Fingerprint of converted values, comparable with the same row read back from SQLite."""
+    parts = []
+    for v in values:
+        if v is None:
+            parts.append("\x00")
+        elif isinstance(v, float) and v.is_integer():
+            # REAL 3.0 and INTEGER 3 both come back from affinity conversions
+            parts.append(str(int(v)))
+        else:
+            parts.append(str(v))
+    return hashlib.blake2b("\x1f".join(parts).encode("utf-8"), digest_size=16).hexdigest()
+
+def _table_value_counts(conn: sqlite3.Connection, table_name: str, fieldnames, columns) -> "_FingerprintCounts":
+    """_FingerprintCounts of the rows already in table_name, over the columns a csv import writes."""
+    known = {c["name"] for c in columns}
+    names = [c for c in fieldnames if c in known]
+    if not names:
+        return _FingerprintCounts()
+    cur = conn.execute(f'SELECT {", ".join(_q(c) for c in names)} FROM {_q(table_name)}')
+    return _FingerprintCounts((_value_key(r), 1) for r in cur)
+
+def _baseline_chunks(rows, mapper, chunk_rows, existing):
+    """Yield (values, fingerprints, None) for a csv whose table already holds rows.
+
+    Every csv row is indexed; only rows matching none of the table's rows
+    (``existing``, value keys counted by occurrence) are inserted.
+    """
+    try:
+        for chunk in _iter_chunks((r for r in rows if r), chunk_rows):
+            converted = [mapper(r) for r in chunk]
+            new = existing.take([_value_key(v) for v in converted])
+            values, added = [], {}
+            for row, vals, is_new in zip(chunk, converted, new):
+                fp = _row_fingerprint(row)
+                added[fp] = added.get(fp, 0) + 1
+                if is_new:
+                    values.append(vals)
+            yield values, added, None
+    finally:
+        existing.close()
+
+def _read_csv_header(csv_path: str):
+    with open(csv_path, "r", encoding="utf-8-sig", newline="") as f:
+        return next(csv.reader(f), None) or []
+
+def _iter_csv_body(csv_path: str):
+    with open(csv_path, "r", encoding="utf-8-sig", newline="") as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        yield from reader
+
+def _starts_line(csv_path: str, offset: int) -> bool:
+    """True if offset is 0 or right after a newline, i.e. a recorded end of file is a row boundary."""
+    if not offset:
+        return True
+    with open(csv_path, "rb") as fb:
+        fb.seek(offset - 1)
+        return fb.read(1) == b"\n"
+
+def _last_line_end(csv_path: str, start: int, end: int) -> int:
+    """Offset right after the last newline in bytes [start, end) of csv_path, or start if there is none."""
+    with open(csv_path, "rb") as fb:
+        pos = end
+        while pos > start:
+            block = max(start, pos - 64 * 1024)
+            fb.seek(block)
+            i = fb.read(pos - block).rfind(b"\n")
+            if i >= 0:
+                return block + i + 1
+            pos = block
+    return start
+
+def _convert_csv_tail(csv_path: str, start: int, end: int, hasher, mapper, chunk_rows, job):
+    """_convert_csv_rows over the bytes [start, end) appended since the previous import.
+
+    ``end`` must be a row boundary (see _last_line_end).
+
+    ``hasher`` holds the sha256 of bytes [0, start) and is fed the tail as it
+    is parsed, so the file is read once. Each chunk's mark is the
+    (sha256, byte offset) of the file up to its last row: recorded with the
+    chunk, an interrupted import resumes right after it. job["sha"] and
+    job["size"] are set once the tail is exhausted.
+    """
+    pos = start
+
+    def lines():
+        nonlocal pos
+        with open(csv_path, "rb") as fb:
+            fb.seek(start)
+            while pos < end:
+                line = fb.readline(end - pos)
+                if not line:
+                    break
+                hasher.update(line)
+                pos += len(line)
+                yield line.decode("utf-8")
+
+    # csv.reader pulls lines only as far as the row it returns, and chunks
+    # are yielded as soon as they fill up, so ``pos`` is the end of the chunk
+    for values, added, _ in _convert_csv_rows(csv.reader(lines()), mapper, chunk_rows):
+        yield values, added, (hasher.copy().hexdigest(), pos)
+    job["sha"], job["size"] = hasher.hexdigest(), pos
+
+class _HashingReader(io.RawIOBase):
+    """Binary reader that hashes (sha256) and counts every byte read through it."""
+
+    def __init__(self, raw):
+        self._raw = raw
+        self.sha = hashlib.sha256()
+        self.size = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        n = self._raw.readinto(b)
+        if n:
+            self.sha.update(memoryview(b)[:n])
+            self.size += n
+        return n
+
+    def close(self):
+        self._raw.close()
+        super().close()
+
+def _open_csv_one_pass(csv_path: str, table_name: str):
+    """Infer the schema of csv_path, then open it once for hashing and loading.
+
+    Returns (fieldnames, columns, rows, hasher): ``columns`` come from
+    infer_schema_from_csv, ``rows`` streams the file body and
+    ``hasher.sha`` / ``hasher.size`` describe the whole file once ``rows``
+    is exhausted.
+    """
+    columns = infer_schema_from_csv(csv_path, table_name=table_name)
+    hasher = _HashingReader(open(csv_path, "rb"))
+    f = io.TextIOWrapper(io.BufferedReader(hasher, 1024 * 1024), encoding="utf-8-sig", newline="")
+    reader = csv.reader(f)
+    fieldnames = next(reader, None) or []
+
+    def rows():
+        try:
+            yield from reader
+        finally:
+            f.close()
+
+    return fieldnames, columns, rows(), hasher
+
+def _stored_columns(conn: sqlite3.Connection, table_name: str):
+    """Columns of an existing memento table with the subtypes recorded at import."""
+    meta = dict(conn.execute(
+        'SELECT column_name, subtype FROM "__memento_column_meta" WHERE table_name = ?', (table_name,)
+    ).fetchall())
+    return [
+        {"name": r[1], "subtype": meta.get(r[1])}
+        for r in conn.execute(f"PRAGMA table_info({_q(table_name)})")
+    ]
+
+def _file_signature(path: str):
+    st = os.stat(path)
+    return (st.st_size, st.st_mtime_ns, st.st_ino)
+
+def _connect_readonly(db_path: str) -> sqlite3.Connection:
+    return sqlite3.connect(pathlib.Path(os.path.abspath(db_path)).as_uri() + "?mode=ro", uri=True)
+
+# ---- import jobs: prepare (any process) / apply (single writer) ----------------
+
+def _prepare_csv_job(db_path, csv_path, name, state, table_present, chunk_rows=IMPORT_CHUNK_ROWS, file_sig=None):
+    """Hash, infer and convert one CSV without writing anything.
+
+    ``state`` is the (sha256, table_name, byte_offset, file_sig) row recorded
+    in __memento_import_state, or None; ``file_sig`` the current
+    (size, mtime_ns, inode) of csv_path, taken before hashing. Reads from the database (stored column
+    subtypes, row index) go through a separate read-only connection, so this
+    can run in a process-pool worker while the writer is busy. "chunks" is
+    a lazy stream of (values, fingerprints, mark), see _convert_csv_rows;
+    "sha" and "size" may only be known once it is exhausted.
+    """
+    prev_sha, prev_table, prev_offset, prev_sig = state or (None, None, None, None)
+    if ONE_PASS_IMPORT and not state and not table_present:
+        return _prepare_one_pass_job(csv_path, name, chunk_rows, file_sig)
+    file_sig = file_sig or _file_signature(csv_path)
+    job = {
+        "name": name,
+        "table_name": prev_table or os.path.splitext(name)[0],
+        "sha": None,
+        # bytes written after the stat are left for the next import
+        "size": file_sig[0],
+        "file_sig": file_sig,
+        "action": "skip",
+        "columns": None,
+        "insert_sql": None,
+        "chunks": (),
+        "replace_index": False,
+    }
+    table_name = job["table_name"]
+
+    # hash the previously imported prefix first: when rows were only
+    # appended, the rest is hashed while the tail is parsed
+    hasher = hashlib.sha256()
+    prefix_len = prev_offset if prev_offset and prev_offset <= job["size"] else 0
+    prefix_len = _sha256_update(hasher, csv_path, 0, prefix_len)
+    appended = bool(prefix_len) and hasher.hexdigest() == prev_sha
+
+    def finish_hash():
+        if job["sha"] is None:
+            job["size"] = prefix_len + _sha256_update(hasher, csv_path, prefix_len, job["size"])
+            job["sha"] = hasher.hexdigest()
+
+    if not (appended and job["size"] > prefix_len and _starts_line(csv_path, prefix_len)):
+        appended = False
+        finish_hash()
+    if appended:
+        # a row still being written is left for the next import: the
+        # recorded offset must stay on a row boundary
+        job["size"] = _last_line_end(csv_path, prefix_len, job["size"])
+        if job["size"] == prefix_len:
+            return job
+
+    if state:
+        # already imported that exact file (only its stat changed, e.g. touched or copied)
+        if prev_sha == job["sha"]:
+            if prev_sig != job["file_sig"]:
+                job["action"] = "touch"
+            return job
+        # hash differs: never rewrite the table, at most append the new rows
+        if not INCREMENTAL_IMPORT or not table_present:
+            return job
+        if prev_offset is None:
+            # tracked before the row index existed: diff against the table itself
+            job["action"] = "baseline"
+        else:
+            job["action"] = "delta"
+    elif table_present:
+        # table exists (user may have already populated it): never rewrite
+        # it, only add the csv rows it does not have yet
+        job["action"] = "baseline"
+    else:
+        job["action"] = "create"
+
+    fieldnames = _read_csv_header(csv_path)
+    if not fieldnames:
+        finish_hash()
+        job["action"] = "skip" if state else "record"
+        return job
+
+    existing = indexed = None
+    if job["action"] == "create":
+        columns = infer_schema_from_csv(csv_path, table_name=table_name)
+        job["columns"] = columns
+        job["replace_index"] = True
+        rows = _iter_csv_body(csv_path)
+    else:
+        conn = _connect_readonly(db_path)
+        try:
+            columns = _stored_columns(conn, table_name)
+            if job["action"] == "baseline":
+                # no usable row index: match csv rows against the table's rows
+                job["replace_index"] = True
+                existing = _table_value_counts(conn, table_name, fieldnames, columns)
+                rows = _iter_csv_body(csv_path)
+            elif appended:
+                # pure append: only parse the bytes after the previous end of file
+                rows = None
+            else:
+                rows, indexed = _iter_csv_body(csv_path), _FingerprintCounts(_iter_row_index(conn, name))
+        finally:
+            conn.close()
+
+    insert_sql, mapper = _row_mapper(table_name, fieldnames, columns)
+    if insert_sql and existing is not None:
+        job["insert_sql"] = insert_sql
+        job["chunks"] = _baseline_chunks(rows, mapper, chunk_rows, existing)
+    elif insert_sql and appended:
+        job["insert_sql"] = insert_sql
+        job["chunks"] = _convert_csv_tail(csv_path, prefix_len, job["size"], hasher, mapper, chunk_rows, job)
+    elif insert_sql:
+        job["insert_sql"] = insert_sql
+        job["chunks"] = _convert_csv_rows(rows, mapper, chunk_rows, indexed=indexed)
+    else:
+        finish_hash()
+        for counts in (existing, indexed):
+            if counts is not None:
+                counts.close()
+        if job["action"] == "baseline":
+            job["chunks"] = _fingerprint_chunks(rows, chunk_rows)
+    return job
+
+def _prepare_one_pass_job(csv_path, name, chunk_rows, file_sig):
+    """The "create" job of _prepare_csv_job, hashing csv_path while it is loaded.
+
+    "sha" and "size" are filled in when the chunks run out.
+    """
+    table_name = os.path.splitext(name)[0]
+    job = {
+        "name": name,
+        "table_name": table_name,
+        "sha": None,
+        "size": None,
+        "file_sig": file_sig or _file_signature(csv_path),
+        "action": "create",
+        "columns": None,
+        "insert_sql": None,
+        "chunks": (),
+        "replace_index": True,
+    }
+    fieldnames, columns, rows, hasher = _open_csv_one_pass(csv_path, table_name)
+    if not fieldnames:
+        rows.close()
+        job["sha"], job["size"] = _sha256_file(csv_path), os.path.getsize(csv_path)
+        job["action"] = "record"
+        return job
+
+    insert_sql, mapper = _row_mapper(table_name, fieldnames, columns)
+    job["columns"] = columns
+    job["insert_sql"] = insert_sql
+
+    def chunks():
+        yield from _convert_csv_rows(rows, mapper, chunk_rows)
+        job["sha"], job["size"] = hasher.sha.hexdigest(), hasher.size
+
+    job["chunks"] = chunks()
+    return job
+
+def _prepare_csv_job_spilled(*args):
+    """_prepare_csv_job for a process-pool worker.
+
+    The chunks are pickled one at a time into a temp file instead of being
+    returned: neither the worker nor the parent ever holds more than one
+    chunk, and the job sent back is only the (small) description.
+    """
+    job = _prepare_csv_job(*args)
+    fd, path = tempfile.mkstemp(prefix="memento-", suffix=".chunks")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in job["chunks"]:
+                pickle.dump(chunk, f, pickle.HIGHEST_PROTOCOL)
+    except BaseException:
+        os.unlink(path)
+        raise
+    job["chunks"] = path
+    return job
+
+def _unspill_chunks(path: str):
+    """Read back, one at a time, the chunks written by _prepare_csv_job_spilled."""
+    with open(path, "rb") as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
+
+def _apply_spilled_job(apply, job):
+    """apply(job) a job returned by _prepare_csv_job_spilled, then delete its chunk file."""
+    path = job["chunks"]
+    try:
+        job["chunks"] = _unspill_chunks(path)
+        return apply(job)
+    finally:
+        job["chunks"] = ()
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+def _apply_csv_job(write, job) -> int:
+    """Write a prepared job through ``write(fn)``; returns the rows inserted.
+
+    ``write`` runs fn(conn) on the database's single writer (Datasette's
+    execute_write_fn, or a private connection). The table, each chunk and
+    the final import state are separate short transactions, so other writes
+    never wait for more than one chunk. An interrupted import resumes
+    cleanly: chunks commit their rows with their row-index increments (and
+    appends their mark), while the state only records the file at the end.
+    """
+    if job["action"] == "skip":
+        return 0
+    name, table_name = job["name"], job["table_name"]
+    file_size, mtime_ns, inode = job["file_sig"]
+    if job["action"] == "touch":
+        def touch(conn):
+            with _transaction(conn):
+                conn.execute(
+                    'UPDATE "__memento_import_state" SET file_size = ?, mtime_ns = ?, inode = ? WHERE csv_name = ?',
+                    (file_size, mtime_ns, inode, name),
+                )
+        write(touch)
+        return 0
+
+    def start(conn):
+        with _transaction(conn):
+            if job["action"] == "create":
+                _create_memento_table(conn, table_name, job["columns"])
+            if job["replace_index"]:
+                conn.execute('DELETE FROM "__memento_row_index" WHERE csv_name = ?', (name,))
+
+    def apply_chunk(conn, values, added, mark):
+        with _transaction(conn):
+            if values:
+                conn.executemany(job["insert_sql"], values)
+            _store_row_index(conn, name, added)
+            if mark is not None:
+                conn.execute(
+                    'UPDATE "__memento_import_state" SET sha256 = ?, byte_offset = ? WHERE csv_name = ?',
+                    (mark[0], mark[1], name),
+                )
+
+    def finish(conn):
+        with _transaction(conn):
+            conn.execute(
+                'INSERT OR REPLACE INTO "__memento_import_state"'
+                '(csv_name, table_name, sha256, imported_at, byte_offset, file_size, mtime_ns, inode) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (name, table_name, job["sha"], datetime.utcnow().isoformat() + "Z", job["size"], file_size, mtime_ns, inode)
+            )
+            # after the bulk load, so the rows above are counted by the backfill, not per-row triggers
+            ensure_table_summary(conn, table_name)
+
+    write(start)
+    inserted = 0
+    for values, added, mark in job["chunks"]:
+        write(lambda conn: apply_chunk(conn, values, added, mark))
+        inserted += len(values)
+    write(finish)
+    return inserted
+
+def _create_memento_table(conn: sqlite3.Connection, table_name: str, columns):
+    cols_sql = ", ".join([f"{_q(c['name'])} {c['sql_type']}" for c in columns])
+    conn.execute(f'CREATE TABLE IF NOT EXISTS {_q(table_name)} ({cols_sql})')
+
+    # store widget metadata
+    conn.executemany(
+        'INSERT OR REPLACE INTO "__memento_column_meta"(table_name, column_name, widget, subtype, format) VALUES (?, ?, ?, ?, ?)',
+        [(table_name, c["name"], c["widget"], c["subtype"], c.get("format")) for c in columns],
+    )
+
+def import_csv_into_sqlite(conn: sqlite3.Connection, csv_path: str, table_name: str, chunk_rows: int = IMPORT_CHUNK_ROWS):
+    """Create table_name from csv_path and load every row (no import-state bookkeeping)."""
+    if ONE_PASS_IMPORT:
+        fieldnames, columns, rows, _ = _open_csv_one_pass(csv_path, table_name)
+    else:
+        columns = infer_schema_from_csv(csv_path, table_name=table_name)
+        fieldnames, rows = _read_csv_header(csv_path), _iter_csv_body(csv_path)
+    with _transaction(conn):
+        _create_memento_table(conn, table_name, columns)
+        # import rows: stream through precompiled converters, executemany per chunk
+        insert_sql, mapper = _row_mapper(table_name, fieldnames, columns)
+        if insert_sql:
+            for values, _, _ in _convert_csv_rows(rows, mapper, chunk_rows):
+                conn.executemany(insert_sql, values)
+
+# ---- parallel ingestion --------------------------------------------------------
+
+# Process-pool size for ensure_imported_from_csvs; 1 imports serially.
+# Overridable with {"plugins": {"memento_ui": {"import_workers": N}}} in metadata.json.
+IMPORT_WORKERS = min(4, os.cpu_count() or 1)
+
+# Re-hash every CSV at startup even when (size, mtime_ns, inode) are unchanged.
+# Overridable with "paranoid_hash" in the same plugin config.
+PARANOID_HASH = False
+
+def _log_progress(name: str, stage: str, **info):
+    # unchanged files are the common case: only report actual work
+    if stage in ("queued", "skip", "touch") or info.get("action") in ("skip", "touch"):
+        return
+    extra = " ".join(f"{k}={v}" for k, v in info.items())
+    log.log(logging.WARNING if stage == "failed" else logging.INFO, "%s: %s %s", name, stage, extra)
+
+def _load_import_state(conn: sqlite3.Connection) -> dict:
+    """{csv_name: (sha256, table_name, byte_offset, file_sig or None)} from __memento_import_state."""
+    return {
+        r[0]: (r[1], r[2], r[3], (r[4], r[5], r[6]) if r[4] is not None else None)
+        for r in conn.execute(
+            'SELECT csv_name, sha256, table_name, byte_offset, file_size, mtime_ns, inode FROM "__memento_import_state"'
+        )
+    }
+
+def _csv_tasks(conn: sqlite3.Connection, names, state: dict, paranoid: bool, progress):
+    """(csv_path, name, state, table_present, file_sig) for each CSV in names that may need importing."""
+    tasks = []
+    for name in names:
+        if not name.lower().endswith(".csv"):
+            continue
+        csv_path = os.path.join(CSV_DIR, name)
+        try:
+            sig = _file_signature(csv_path)
+        except FileNotFoundError:
+            continue
+        st = state.get(name)
+        if st and not paranoid and st[3] == sig:
+            # stat unchanged since the last import: skip hashing entirely
+            progress(name, "skip")
+            continue
+        table_name = st[1] if st else os.path.splitext(name)[0]
+        tasks.append((csv_path, name, st, table_exists(conn, table_name), sig))
+    for t in tasks:
+        progress(t[1], "queued")
+    return tasks
+
+def _report_applied(progress, job, rows: int, started: float):
+    progress(job["name"], "imported" if job["action"] not in ("skip", "touch") else job["action"],
+             rows=rows, seconds=round(time.perf_counter() - started, 3))
+
+def _setup_import(conn: sqlite3.Connection) -> dict:
+    """Meta tables and summaries in place; returns _load_import_state()."""
+    conn.execute("PRAGMA journal_mode=WAL;")
+    with _transaction(conn):
+        ensure_memento_meta_tables(conn)
+        state = _load_import_state(conn)
+        for st in state.values():
+            ensure_table_summary(conn, st[1])
+    return state
+
+def ensure_imported_from_csvs(db_path: str, workers: int = None, progress=_log_progress, paranoid: bool = None, write=None):
+    """Import new CSVs from CSV_DIR and the new rows of changed ones.
+
+    Files whose (size, mtime_ns, inode) match the recorded ones are skipped
+    without being read, unless ``paranoid`` (default PARANOID_HASH).
+
+    Each file is prepared (hashed, inferred, converted) independently - in a
+    pool of ``workers`` processes when there is more than one file - and
+    applied in completion order through ``write(fn)``, which runs fn(conn)
+    on the database's single writer (a private connection when omitted),
+    in short transactions (see _apply_csv_job). ``progress(name, stage, **info)``
+    is called as each file moves through queued/prepared/imported/failed.
+    """
+    if not os.path.isdir(CSV_DIR) or not os.path.isfile(db_path):
+        return
+    progress = progress or (lambda *a, **k: None)
+    workers = IMPORT_WORKERS if workers is None else max(1, int(workers))
+    paranoid = PARANOID_HASH if paranoid is None else bool(paranoid)
+
+    conn = None
+    if write is None:
+        conn = sqlite3.connect(db_path)
+
+        def write(fn):
+            return fn(conn)
+
+    try:
+        state = write(_setup_import)
+        reader = _connect_readonly(db_path)
+        try:
+            tasks = _csv_tasks(reader, sorted(os.listdir(CSV_DIR)), state, paranoid, progress)
+        finally:
+            reader.close()
+
+        def apply(job):
+            started = time.perf_counter()
+            n = _apply_csv_job(write, job)
+            _report_applied(progress, job, n, started)
+
+        if workers <= 1 or len(tasks) <= 1:
+            for csv_path, name, st, present, sig in tasks:
+                try:
+                    apply(_prepare_csv_job(db_path, csv_path, name, st, present, file_sig=sig))
+                except Exception as ex:
+                    progress(name, "failed", error=repr(ex))
+            return
+
+        # spawn, never fork: this runs in the background import thread, and a
+        # forked child would inherit the parent's threads' locks mid-flight
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=min(workers, len(tasks)), mp_context=multiprocessing.get_context("spawn")
+        ) as pool:
+            futures = {
+                pool.submit(_prepare_csv_job_spilled, db_path, csv_path, name, st, present, IMPORT_CHUNK_ROWS, sig): name
+                for csv_path, name, st, present, sig in tasks
+            }
+            for fut in concurrent.futures.as_completed(futures):
+                name = futures[fut]
+                try:
+                    job = fut.result()
+                    progress(name, "prepared", action=job["action"])
+                    _apply_spilled_job(apply, job)
+                except Exception as ex:
+                    progress(name, "failed", error=repr(ex))
+    finally:
+        if conn is not None:
+            conn.close()
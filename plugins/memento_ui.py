@@ -3,439 +3,328 @@
 # v8 - Robust CSV type inference (m/d/yy), safer boolean detection, larger samples
 
 import os
+import io
+import json
+import sys
 import csv
-import re
-import hashlib
+import logging
+import threading
 import sqlite3
+import time
+import select
+import asyncio
+import ctypes
+import ctypes.util
 from urllib.parse import unquote, quote
 from datetime import datetime, date
 
 from datasette import hookimpl
-from datasette.utils.asgi import Response
-
-
-BASE_DIR = os.path.dirname(os.path.dirname(__file__))
-CSV_DIR = os.path.join(BASE_DIR, "memento_csvs")
-DB_PATH = None  # resolved at runtime from the default Datasette database
+from datasette.utils.asgi import Response, AsgiStream
+
+# the import pipeline lives in plugins/memento_import.py, a real module so
+# process-pool workers can import it; plugins/ on sys.path makes it (and the
+# shared insert_form engine) importable
+_PLUGINS_DIR = os.path.dirname(os.path.abspath(__file__))
+if _PLUGINS_DIR not in sys.path:
+    sys.path.append(_PLUGINS_DIR)
+
+import insert_form
+from memento_import import (
+    BASE_DIR,
+    CSV_DIR,
+    _CONVERTERS,
+    _apply_csv_job,
+    _connect_readonly,
+    _convert_text,
+    _csv_tasks,
+    _guess_widget_from_name,
+    _iso_date,
+    _iso_datetime,
+    _is_forced_non_boolean,
+    _iter_chunks,
+    _load_import_state,
+    _log_progress,
+    _prepare_csv_job,
+    _q,
+    _report_applied,
+    _transaction,
+    _try_parse_bool,
+    _try_parse_date,
+    _try_parse_datetime,
+    _try_parse_duration_hhmm,
+    ensure_imported_from_csvs,
+)
 
-# ---- overrides: columns that must NOT be treated as booleans ------------------
+# import progress goes to the "memento" logger; print it like before unless
+# the server already configured logging
+_log = logging.getLogger("memento")
+if not _log.handlers and not logging.getLogger().handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("[memento] %(message)s"))
+    _log.addHandler(_handler)
+    _log.setLevel(logging.INFO)
 
-_NON_BOOL_CACHE = None
 
-def _load_non_boolean_overrides() -> dict:
-    """Parse BASE_DIR/not_booleans.txt.
+# ---- background import ---------------------------------------------------------
 
-    Format (one per line):
-        table_name: col1, col2, col3
+# Shared with /-/memento/import-status.json; written only by the import thread.
+_IMPORT_STATUS = {"state": "idle", "started_at": None, "finished_at": None, "error": None, "files": {}}
 
-    Returns:
-        {table_name_lower: {colname_lower, ...}, ...}
-    """
-    global _NON_BOOL_CACHE
-    if _NON_BOOL_CACHE is not None:
-        return _NON_BOOL_CACHE
-
-    path = os.path.join(BASE_DIR, "not_booleans.txt")
-    overrides: dict = {}
-    if os.path.isfile(path):
-        with open(path, "r", encoding="utf-8") as f:
-            for raw in f:
-                line = raw.strip()
-                if not line or line.startswith("#"):
-                    continue
-                if ":" not in line:
-                    continue
-                t, cols = line.split(":", 1)
-                t = t.strip().lower()
-                if not t:
-                    continue
-                colset = overrides.setdefault(t, set())
-                for c in cols.split(","):
-                    cc = c.strip()
-                    if cc:
-                        colset.add(cc.lower())
-
-    _NON_BOOL_CACHE = overrides
-    return overrides
-
-def _is_forced_non_boolean(table_name: str, colname: str) -> bool:
-    if not table_name or not colname:
-        return False
-    ov = _load_non_boolean_overrides()
-    tn = table_name.strip().lower()
-    cn = colname.strip().lower()
-    return (tn in ov) and (cn in ov[tn])
+# stages after which a file's table is complete (or will not be touched)
+_IMPORT_DONE_STAGES = ("imported", "skip", "touch", "failed")
 
-# ---- util: quoting identifiers ------------------------------------------------
+def _utcnow_iso() -> str:
+    return datetime.utcnow().isoformat() + "Z"
 
-def _q(ident: str) -> str:
-    # Quote SQLite identifier with double quotes
-    return '"' + ident.replace('"', '""') + '"'
+def _status_progress(name: str, stage: str, **info):
+    entry = dict(_IMPORT_STATUS["files"].get(name) or {})
+    entry.update(info)
+    entry["stage"] = stage
+    entry["updated_at"] = _utcnow_iso()
+    _IMPORT_STATUS["files"][name] = entry
+    _log_progress(name, stage, **info)
 
-# ---- type inference -----------------------------------------------------------
+def _run_background_import(db_path: str, workers=None, paranoid=None, write=None):
+    _IMPORT_STATUS.update(state="running", started_at=_utcnow_iso(), finished_at=None, error=None, files={})
+    try:
+        ensure_imported_from_csvs(db_path, workers=workers, progress=_status_progress, paranoid=paranoid, write=write)
+        _IMPORT_STATUS["state"] = "done"
+    except Exception as ex:
+        _IMPORT_STATUS.update(state="failed", error=repr(ex))
+    finally:
+        _IMPORT_STATUS["finished_at"] = _utcnow_iso()
 
-_BOOL_TRUE = {"1", "true", "t", "yes", "y", "on"}
-_BOOL_FALSE = {"0", "false", "f", "no", "n", "off"}
+def start_background_import(db_path: str, workers=None, paranoid=None, write=None) -> threading.Thread:
+    """Run ensure_imported_from_csvs in a daemon thread, reporting into _IMPORT_STATUS.
 
-_DURATION_RE = re.compile(r"^\s*(\d{1,3})\s*:\s*(\d{2})\s*$")
+    ``write`` is passed through: with _database_writer() the import commits
+    chunk by chunk on Datasette's write connection, interleaved with other writes.
+    """
+    t = threading.Thread(
+        target=_run_background_import,
+        args=(db_path, workers, paranoid, write),
+        name="memento-import",
+        daemon=True,
+    )
+    t.start()
+    return t
+
+# ---- live drop-folder watcher --------------------------------------------------
+
+# Import CSVs dropped into (or appended to in) CSV_DIR while the server runs.
+# Overridable with "watch_csvs" / "watch_poll_seconds" in the plugin config.
+WATCH_CSVS = True
+# rescan interval when inotify is not available (Windows, macOS, old kernels)
+WATCH_POLL_SECONDS = 2.0
+# a changed file is imported once its (size, mtime_ns, inode) held still this long
+WATCH_DEBOUNCE_SECONDS = 1.0
+# safety rescan while inotify reports nothing
+WATCH_RESCAN_SECONDS = 60.0
+
+class _InotifyWaiter:
+    """Blocks until CSV_DIR changes, via inotify through ctypes (Linux only)."""
+
+    # IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    _MASK = 0x002 | 0x004 | 0x008 | 0x080 | 0x100 | 0x200
+
+    def __init__(self, path: str):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or None, use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError("inotify not available")
+        fd = libc.inotify_init1(os.O_NONBLOCK | getattr(os, "O_CLOEXEC", 0))
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1")
+        if libc.inotify_add_watch(fd, os.fsencode(path), self._MASK) < 0:
+            err = ctypes.get_errno()
+            os.close(fd)
+            raise OSError(err, "inotify_add_watch")
+        self.fd = fd
+
+    def wait(self, timeout: float) -> bool:
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return False
+        # only "something changed" matters: drain the queued events
+        try:
+            while os.read(self.fd, 65536):
+                pass
+        except BlockingIOError:
+            pass
+        return True
 
-_DATE_FORMATS = (
-    "%Y-%m-%d",
-    "%d/%m/%Y",
-    "%Y/%m/%d",
-    "%m/%d/%y",
-    "%m/%d/%Y",
-    "%m-%d-%y",
-    "%m-%d-%Y",
-)
-_DATETIME_FORMATS = (
-    "%Y-%m-%d %H:%M",
-    "%Y-%m-%d %H:%M:%S",
-    "%Y-%m-%dT%H:%M",
-    "%Y-%m-%dT%H:%M:%S",
-    "%Y-%m-%dT%H:%M:%S.%f",
-    "%m/%d/%y %H:%M",
-    "%m/%d/%Y %H:%M",
-    "%m/%d/%y %H:%M:%S",
-    "%m/%d/%Y %H:%M:%S",
-    "%m-%d-%y %H:%M",
-    "%m-%d-%Y %H:%M",
-    "%m-%d-%y %H:%M:%S",
-    "%m-%d-%Y %H:%M:%S",
-)
-def _try_parse_bool(s: str):
-    x = s.strip().lower()
-    if x in _BOOL_TRUE:
-        return 1
-    if x in _BOOL_FALSE:
-        return 0
-    return None
-
-def _try_parse_int(s: str):
-    x = s.strip()
-    if x == "":
-        return None
-    try:
-        if re.match(r"^[+-]?\d+$", x):
-            return int(x)
-    except Exception:
-        pass
-    return None
+    def close(self):
+        os.close(self.fd)
 
-def _try_parse_float(s: str):
-    x = s.strip()
-    if x == "":
-        return None
+def _open_dir_waiter(path: str):
     try:
-        # accept comma decimals too
-        x2 = x.replace(",", ".")
-        return float(x2)
-    except Exception:
+        return _InotifyWaiter(path)
+    except (OSError, AttributeError, TypeError):
         return None
 
-def _try_parse_date(s: str):
-    x = s.strip()
-    if x == "":
-        return None
-    # ISO date first
+def _scan_csv_dir() -> dict:
+    """{csv_name: (size, mtime_ns, inode)} for the CSVs currently in CSV_DIR."""
+    sigs = {}
     try:
-        # fromisoformat accepts YYYY-MM-DD
-        d = date.fromisoformat(x)
-        return d
-    except Exception:
+        with os.scandir(CSV_DIR) as it:
+            for e in it:
+                if e.name.lower().endswith(".csv") and e.is_file():
+                    st = e.stat()
+                    sigs[e.name] = (st.st_size, st.st_mtime_ns, st.st_ino)
+    except FileNotFoundError:
         pass
-    for fmt in _DATE_FORMATS:
-        try:
-            return datetime.strptime(x, fmt).date()
-        except Exception:
-            continue
-    return None
+    return sigs
 
-def _try_parse_datetime(s: str):
-    x = s.strip()
-    if x == "":
-        return None
-    # ISO first (supports "YYYY-MM-DDTHH:MM:SS(.fff)" and "YYYY-MM-DD HH:MM:SS")
+def _import_dropped_csvs(db_path: str, names, write, progress=_status_progress):
+    """Import the given CSVs of CSV_DIR through ``write(fn)``, the live server's writer.
+
+    Files are prepared (hashed, inferred, converted) in the calling thread
+    from a read-only connection; only each chunk's inserts run on the write
+    connection, so other writes wait for one chunk, never for parsing.
+    """
+    conn = _connect_readonly(db_path)
     try:
-        # normalize 'Z' -> +00:00 (keep as aware, but we'll store ISO)
-        if x.endswith("Z"):
-            x2 = x[:-1] + "+00:00"
-            return datetime.fromisoformat(x2)
-        return datetime.fromisoformat(x)
-    except Exception:
-        pass
-    for fmt in _DATETIME_FORMATS:
+        tasks = _csv_tasks(conn, names, _load_import_state(conn), False, progress)
+    finally:
+        conn.close()
+    for csv_path, name, st, present, sig in tasks:
         try:
-            return datetime.strptime(x, fmt)
-        except Exception:
-            continue
-    return None
+            job = _prepare_csv_job(db_path, csv_path, name, st, present, file_sig=sig)
+            progress(name, "prepared", action=job["action"])
+            started = time.perf_counter()
+            n = _apply_csv_job(write, job)
+            _report_applied(progress, job, n, started)
+        except Exception as ex:
+            progress(name, "failed", error=repr(ex))
+
+def _watch_csv_dir(db_path: str, write, stop: threading.Event, poll: float = None, after: threading.Thread = None):
+    """Watch CSV_DIR until ``stop`` is set, importing files once they stop changing."""
+    if after is not None:
+        # never race the startup import for the same files
+        after.join()
+    poll = WATCH_POLL_SECONDS if poll is None else max(0.2, float(poll))
+    waiter = _open_dir_waiter(CSV_DIR) if os.path.isdir(CSV_DIR) else None
+    # empty baseline: the first scan re-checks every file against the import state
+    # (stat-only for unchanged ones), covering drops made during the startup import
+    last = {}
+    pending = {}  # name -> (file_sig, first seen with that sig)
+    try:
+        while not stop.is_set():
+            now = time.monotonic()
+            current = _scan_csv_dir()
+            for name, sig in current.items():
+                if sig != last.get(name):
+                    pending[name] = (sig, now)
+            for name in set(pending) - set(current):
+                del pending[name]
+            last = current
+
+            ready = sorted(n for n, (_, since) in pending.items() if now - since >= WATCH_DEBOUNCE_SECONDS)
+            if ready:
+                for name in ready:
+                    del pending[name]
+                _IMPORT_STATUS.update(state="running", started_at=_utcnow_iso(), finished_at=None, error=None)
+                try:
+                    _import_dropped_csvs(db_path, ready, write)
+                    _IMPORT_STATUS["state"] = "done"
+                except Exception as ex:
+                    _IMPORT_STATUS.update(state="failed", error=repr(ex))
+                finally:
+                    _IMPORT_STATUS["finished_at"] = _utcnow_iso()
+                continue
 
-def _try_parse_duration_hhmm(s: str):
-    m = _DURATION_RE.match(s or "")
-    if not m:
-        return None
-    hh = int(m.group(1))
-    mm = int(m.group(2))
-    if 0 <= mm <= 59:
-        return hh, mm
-    return None
+            if pending:
+                timeout = WATCH_DEBOUNCE_SECONDS
+            else:
+                timeout = WATCH_RESCAN_SECONDS if waiter else poll
+            if waiter:
+                waiter.wait(timeout)
+            else:
+                stop.wait(timeout)
+    finally:
+        if waiter:
+            waiter.close()
 
+def _database_writer(db):
+    """write(fn) for worker threads: runs fn(conn) on db's write connection and returns its result.
 
-def _guess_widget_from_name(colname: str):
-    n = (colname or "").strip().lower()
-    if not n:
-        return None
-    # datetime-ish
-    datetime_tokens = ["datetime", "timestamp", "quando", "ora", "orario", "time", "created", "updated", "modified", "at"]
-    date_tokens = ["date", "data", "giorno", "day"]
-    # prioritize datetime tokens
-    if any(tok in n for tok in datetime_tokens):
-        return ("datetime", "datetime")
-    if any(tok in n for tok in date_tokens):
-        return ("date", "date")
-    return None
-
-def infer_schema_from_csv(csv_path: str, table_name: str = None, sample_rows: int = 5000):
-    """
-    Returns:
-        columns: list of dict: {name, sql_type, widget, subtype}
+    Must be created on the event loop (e.g. in an async startup hook):
+    writes are scheduled back onto it with run_coroutine_threadsafe.
     """
-    with open(csv_path, "r", encoding="utf-8-sig", newline="") as f:
-        reader = csv.DictReader(f)
-        fieldnames = reader.fieldnames or []
-        # init stats
-        stats = {c: {
-            "nonempty": 0,
-            "bool_ok": 0,
-            "int_ok": 0,
-            "float_ok": 0,
-            "date_ok": 0,
-            "datetime_ok": 0,
-            "duration_ok": 0,
-        } for c in fieldnames}
-
-        rows_seen = 0
-        for row in reader:
-            rows_seen += 1
-            for c in fieldnames:
-                v = row.get(c, "")
-                if v is None:
-                    v = ""
-                s = str(v)
-                if s.strip() == "":
-                    continue
-                st = stats[c]
-                st["nonempty"] += 1
-
-                if _try_parse_bool(s) is not None:
-                    st["bool_ok"] += 1
-                if _try_parse_int(s) is not None:
-                    st["int_ok"] += 1
-                if _try_parse_float(s) is not None:
-                    st["float_ok"] += 1
-                if _try_parse_date(s) is not None:
-                    st["date_ok"] += 1
-                if _try_parse_datetime(s) is not None:
-                    st["datetime_ok"] += 1
-                if _try_parse_duration_hhmm(s) is not None:
-                    st["duration_ok"] += 1
-            if rows_seen >= sample_rows:
-                break
-
-    columns = []
-    for c in fieldnames:
-        st = stats[c]
-        n = st["nonempty"]
-        # default
-        sql_type = "TEXT"
-        widget = "text"
-        subtype = None
-
-        def ratio(k):
-            return (st[k] / n) if n else 0.0
-
-        # Decide based on strong ratios
-        # If column is explicitly marked as non-boolean, never pick the checkbox widget.
-        if n and stats[c]['nonempty'] >= 10 and ratio("bool_ok") >= 0.95 and not _is_forced_non_boolean(table_name or "", c):
-            sql_type = "INTEGER"
-            widget = "checkbox"
-            subtype = "boolean"
-        elif n and ratio("int_ok") >= 0.95:
-            sql_type = "INTEGER"
-            widget = "number"
-            subtype = "integer"
-        elif n and ratio("float_ok") >= 0.95:
-            sql_type = "REAL"
-            widget = "number"
-            subtype = "float"
-        elif n and ratio("datetime_ok") >= 0.80:
-            sql_type = "TEXT"
-            widget = "datetime"
-            subtype = "datetime"
-        elif n and ratio("date_ok") >= 0.80:
-            sql_type = "TEXT"
-            widget = "date"
-            subtype = "date"
-        elif n and ratio("duration_ok") >= 0.80:
-            sql_type = "TEXT"
-            widget = "duration_hhmm"
-            subtype = "duration_hhmm"
-        else:
-            sql_type = "TEXT"
-            widget = "text"
-            subtype = "text"
-        # Name-based fallback for date/datetime when values are empty or inconclusive
-        if widget == "text":
-            g = _guess_widget_from_name(c)
-            if g:
-                widget, subtype = g
-                sql_type = "TEXT"
-
-        columns.append({"name": c, "sql_type": sql_type, "widget": widget, "subtype": subtype})
-
-    return columns
-
-# ---- import -------------------------------------------------------------------
-
-def _sha256_file(path: str) -> str:
-    h = hashlib.sha256()
-    with open(path, "rb") as f:
-        for chunk in iter(lambda: f.read(1024 * 1024), b""):
-            h.update(chunk)
-    return h.hexdigest()
-
-def ensure_memento_meta_tables(conn: sqlite3.Connection):
-    conn.execute("""
-        CREATE TABLE IF NOT EXISTS "__memento_import_state" (
-            csv_name TEXT PRIMARY KEY,
-            table_name TEXT NOT NULL,
-            sha256 TEXT NOT NULL,
-            imported_at TEXT NOT NULL
-        )
-    """)
-    conn.execute("""
-        CREATE TABLE IF NOT EXISTS "__memento_column_meta" (
-            table_name TEXT NOT NULL,
-            column_name TEXT NOT NULL,
-            widget TEXT NOT NULL,
-            subtype TEXT,
-            PRIMARY KEY (table_name, column_name)
-        )
-    """)
-
-def table_exists(conn: sqlite3.Connection, table_name: str) -> bool:
-    cur = conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name = ?", (table_name,))
-    return cur.fetchone() is not None
-
-def import_csv_into_sqlite(conn: sqlite3.Connection, csv_path: str, table_name: str):
-    columns = infer_schema_from_csv(csv_path, table_name=table_name)
-
-    # create table
-    cols_sql = ", ".join([f"{_q(c['name'])} {c['sql_type']}" for c in columns])
-    conn.execute(f'CREATE TABLE IF NOT EXISTS {_q(table_name)} ({cols_sql})')
+    loop = asyncio.get_running_loop()
 
-    # store widget metadata
-    for c in columns:
-        conn.execute(
-            'INSERT OR REPLACE INTO "__memento_column_meta"(table_name, column_name, widget, subtype) VALUES (?, ?, ?, ?)',
-            (table_name, c["name"], c["widget"], c["subtype"])
-        )
+    def write(fn):
+        return asyncio.run_coroutine_threadsafe(db.execute_write_fn(fn, block=True), loop).result()
 
-    # import rows
-    with open(csv_path, "r", encoding="utf-8-sig", newline="") as f:
-        reader = csv.DictReader(f)
-        fieldnames = reader.fieldnames or []
-        placeholders = ", ".join(["?"] * len(fieldnames))
-        insert_sql = f'INSERT INTO {_q(table_name)} ({", ".join(_q(c) for c in fieldnames)}) VALUES ({placeholders})'
-
-        for row in reader:
-            vals = []
-            for c in fieldnames:
-                v = row.get(c, "")
-                if v is None:
-                    v = ""
-                s = str(v).strip()
-                if s == "":
-                    vals.append(None)
-                else:
-                    # Normalize some types
-                    meta = next((x for x in columns if x["name"] == c), None)
-                    if meta and meta["subtype"] == "boolean":
-                        bv = _try_parse_bool(s)
-                        vals.append(bv if bv is not None else None)
-                    elif meta and meta["subtype"] == "integer":
-                        iv = _try_parse_int(s)
-                        vals.append(iv if iv is not None else s)
-                    elif meta and meta["subtype"] == "float":
-                        fv = _try_parse_float(s)
-                        vals.append(fv if fv is not None else s)
-                    elif meta and meta["subtype"] == "date":
-                        dv = _try_parse_date(s)
-                        vals.append(dv.isoformat() if dv else s)
-                    elif meta and meta["subtype"] == "datetime":
-                        dt = _try_parse_datetime(s)
-                        vals.append(dt.isoformat() if dt else s)
-                    elif meta and meta["subtype"] == "duration_hhmm":
-                        # keep canonical HH:MM
-                        d = _try_parse_duration_hhmm(s)
-                        if d:
-                            vals.append(f"{d[0]}:{d[1]:02d}")
-                        else:
-                            vals.append(s)
-                    else:
-                        vals.append(s)
-            conn.execute(insert_sql, vals)
-
-def ensure_imported_from_csvs(db_path: str):
-    if not os.path.isdir(CSV_DIR) or not os.path.isfile(db_path):
-        return
-
-    conn = sqlite3.connect(db_path)
-    try:
-        conn.execute("PRAGMA journal_mode=WAL;")
-        ensure_memento_meta_tables(conn)
+    return write
 
-        for name in sorted(os.listdir(CSV_DIR)):
-            if not name.lower().endswith(".csv"):
-                continue
-            csv_path = os.path.join(CSV_DIR, name)
-            table_name = os.path.splitext(name)[0]
-
-            sha = _sha256_file(csv_path)
-            cur = conn.execute('SELECT sha256 FROM "__memento_import_state" WHERE csv_name = ?', (name,))
-            row = cur.fetchone()
-            if row:
-                # already imported that exact file
-                if row[0] == sha:
-                    continue
-                # if hash differs, do not auto-reimport to avoid overwriting user data
-                continue
-
-            if not table_exists(conn, table_name):
-                import_csv_into_sqlite(conn, csv_path, table_name)
-            else:
-                # table exists - do not touch (user may have already populated it)
-                pass
-
-            conn.execute(
-                'INSERT OR REPLACE INTO "__memento_import_state"(csv_name, table_name, sha256, imported_at) VALUES (?, ?, ?, ?)',
-                (name, table_name, sha, datetime.utcnow().isoformat() + "Z")
-            )
+def start_csv_watcher(datasette, after: threading.Thread = None, poll: float = None):
+    """Start the CSV_DIR watcher thread, writing through the default database's write connection.
 
-        conn.commit()
-    finally:
-        conn.close()
+    Must be called from the event loop (see _database_writer). Returns the
+    threading.Event that stops the watcher (None for an in-memory database).
+    """
+    db = datasette.get_database()
+    if not db.path:
+        return None
+    write = _database_writer(db)
+
+    stop = threading.Event()
+    threading.Thread(
+        target=_watch_csv_dir,
+        args=(db.path, write, stop, poll, after),
+        name="memento-watch",
+        daemon=True,
+    ).start()
+    return stop
+
+def _importing_csvs() -> dict:
+    """{csv_name: stage} for files the running import has not finished yet."""
+    if _IMPORT_STATUS["state"] != "running":
+        return {}
+    return {
+        name: f.get("stage")
+        for name, f in list(_IMPORT_STATUS["files"].items())
+        if f.get("stage") not in _IMPORT_DONE_STAGES
+    }
 
 # ---- Datasette UI -------------------------------------------------------------
 
 async def _get_memento_tables(datasette):
+    tables = await _get_recorded_memento_tables(datasette)
+    # files still being imported: flag them (and list the ones not recorded yet)
+    pending = _importing_csvs()
+    seen = set()
+    for t in tables:
+        seen.add(t["csv_name"])
+        t["import_stage"] = pending.get(t["csv_name"])
+    for name in sorted(set(pending) - seen):
+        tables.append({
+            "table_name": os.path.splitext(name)[0],
+            "csv_name": name,
+            "imported_at": None,
+            "import_stage": pending[name],
+        })
+    tables.sort(key=lambda t: t["table_name"])
+    return tables
+
+async def _get_recorded_memento_tables(datasette):
     db = datasette.get_database()
     # Prefer tables tracked in import state; fallback to any non-internal tables that have csv counterpart
     try:
-        rows = await db.execute('SELECT table_name, csv_name, imported_at FROM "__memento_import_state" ORDER BY table_name')
+        rows = await db.execute(
+            'SELECT st.table_name, st.csv_name, st.imported_at, s.n, s.min_ts, s.max_ts, s.last_rowid '
+            'FROM "__memento_import_state" st '
+            'LEFT JOIN "__memento_summary" s ON s.table_name = st.table_name '
+            'ORDER BY st.table_name'
+        )
         if rows.rows:
-            return [{"table_name": r[0], "csv_name": r[1], "imported_at": r[2]} for r in rows.rows]
+            return [
+                {
+                    "table_name": r[0], "csv_name": r[1], "imported_at": r[2],
+                    "rows": r[3], "min_ts": r[4], "max_ts": r[5], "last_rowid": r[6],
+                }
+                for r in rows.rows
+            ]
     except Exception:
         pass
 
@@ -446,17 +335,53 @@ async def _get_memento_tables(datasette):
                 tables.append({"table_name": os.path.splitext(name)[0], "csv_name": name, "imported_at": None})
     return tables
 
+# {(db_name, table_name): (schema_version, columns)}
+_COLUMN_META_CACHE = {}
+
+async def _schema_version(db) -> int:
+    res = await db.execute("PRAGMA schema_version")
+    return res.rows[0][0]
+
 async def _get_column_meta(datasette, table_name: str):
+    """Columns of table_name with their form widgets, cached per schema_version.
+
+    A cache hit costs one PRAGMA read. Widgets autodetected on a miss are
+    persisted in one batched write, and only when they differ from what
+    __memento_column_meta already holds, so page views add no write traffic.
+    """
     db = datasette.get_database()
+    key = (db.name, table_name)
+    version = await _schema_version(db)
+    cached = _COLUMN_META_CACHE.get(key)
+    if cached and cached[0] == version:
+        return cached[1]
+
+    cols, detected = await _load_column_meta(db, table_name)
+    if detected:
+        try:
+            # upsert: keep the date format recorded at import
+            await db.execute_write_many(
+                'INSERT INTO "__memento_column_meta"(table_name, column_name, widget, subtype) VALUES (?, ?, ?, ?) '
+                "ON CONFLICT(table_name, column_name) DO UPDATE SET widget = excluded.widget, subtype = excluded.subtype",
+                detected,
+            )
+        except Exception:
+            pass
+    _COLUMN_META_CACHE[key] = (version, cols)
+    return cols
+
+async def _load_column_meta(db, table_name: str):
+    """Return (columns, autodetected meta rows that still need persisting)."""
     cols = []
+    detected = []
     # PRAGMA table_info is easiest via execute
     info = await db.execute(f'PRAGMA table_info({_q(table_name)})')
     # meta
     meta_map = {}
     try:
-        meta = await db.execute('SELECT column_name, widget, subtype FROM "__memento_column_meta" WHERE table_name = ?', (table_name,))
+        meta = await db.execute('SELECT * FROM "__memento_column_meta" WHERE table_name = ?', (table_name,))
         for r in meta.rows:
-            meta_map[r[0]] = {"widget": r[1], "subtype": r[2]}
+            meta_map[r["column_name"]] = {"widget": r["widget"], "subtype": r["subtype"], "format": dict(r).get("format")}
     except Exception:
         pass
 
@@ -508,23 +433,20 @@ async def _get_column_meta(datasette, table_name: str):
                         w, st = "checkbox", "boolean"
                 except Exception:
                     pass
-            # persist autodetected widget for next time
-            try:
-                await db.execute_write(
-                    'INSERT OR REPLACE INTO "__memento_column_meta"(table_name, column_name, widget, subtype) VALUES (?, ?, ?, ?)',
-                    (table_name, name, w or "text", st),
-                )
-            except Exception:
-                pass
+            # persist autodetected widget for next time (batched by the caller)
+            stored = meta_map.get(name)
+            if not stored or (stored["widget"], stored["subtype"]) != (w or "text", st):
+                detected.append((table_name, name, w or "text", st))
         cols.append({
             "name": name,
             "type": col_type,
             "widget": w,
             "subtype": st,
+            "format": meta_map.get(name, {}).get("format"),
             "notnull": bool(r[3]),
             "pk": bool(r[5]),
         })
-    return cols
+    return cols, detected
 
 def _normalize_duration_inputs(form, colname):
     h = form.get(f"{colname}__hh")
@@ -542,20 +464,56 @@ def _normalize_duration_inputs(form, colname):
 
 @hookimpl
 def startup(datasette):
-    # Ensure tables exist before serving
-    try:
-        db_path = datasette.get_database().path
-    except Exception:
-        db_path = os.path.join(BASE_DIR, "output.db")
-    ensure_imported_from_csvs(db_path)
+    # Import in the background: the site serves immediately, /memento shows
+    # tables still importing and /-/memento/import-status.json the progress
+    config = datasette.plugin_config("memento_ui") or {}
+
+    async def inner():
+        # the import writes through Datasette's write connection, one chunk
+        # per transaction, so inserts made from the UI meanwhile never hit
+        # "database is locked"
+        try:
+            db = datasette.get_database()
+        except Exception:
+            db = None
+        if db is not None and db.path:
+            db_path, write = db.path, _database_writer(db)
+        else:
+            db_path, write = os.path.join(BASE_DIR, "output.db"), None
+        importer = start_background_import(
+            db_path, workers=config.get("import_workers"), paranoid=config.get("paranoid_hash"), write=write
+        )
+        if config.get("watch_csvs", WATCH_CSVS):
+            # new or appended CSVs in memento_csvs/ are imported live, once
+            # the startup import is done
+            datasette._memento_watch_stop = start_csv_watcher(datasette, after=importer, poll=config.get("watch_poll_seconds"))
+
+    return inner
 
 @hookimpl
 def register_routes():
     return [
         (r"^/memento$", memento_home),
+        (r"^/memento\.json$", memento_home_json),
+        (r"^/-/memento/import-status\.json$", memento_import_status),
         (r"^/memento/(?P<table>.+)/insert$", memento_insert),
+        (r"^/memento/(?P<table>.+)/bulk$", memento_bulk),
+        (r"^/memento/(?P<table>.+)/export\.csv$", memento_export_csv),
     ]
 
+async def memento_import_status(request, datasette):
+    status = dict(_IMPORT_STATUS)
+    status["files"] = dict(status["files"])
+    status["pending"] = sorted(_importing_csvs())
+    return Response.json(status)
+
+async def memento_home_json(request, datasette):
+    tables = await _get_memento_tables(datasette)
+    return Response.json({
+        "import_running": _IMPORT_STATUS["state"] == "running",
+        "tables": tables,
+    })
+
 async def memento_home(request, datasette):
     tables = await _get_memento_tables(datasette)
     db = datasette.get_database()
@@ -569,62 +527,60 @@ async def memento_home(request, datasette):
             for t in tables
         ],
         "db_name": db.name,
+        "import_running": _IMPORT_STATUS["state"] == "running",
+        "import_status_url": datasette.urls.path("/-/memento/import-status.json"),
     }
     html = await datasette.render_template("memento_home.html", ctx, request=request)
     return Response.html(html)
 
+def _memento_form_value(widget, form, colname):
+    """Value of one column from the memento insert form; None for an empty field."""
+    if widget == "duration_hhmm":
+        v = _normalize_duration_inputs(form, colname)
+    elif widget == "checkbox":
+        v = 1 if form.get(colname) in ("on", "1", "true", "True") else 0
+    else:
+        v = form.get(colname)
+
+    if v is None or str(v).strip() == "":
+        return None
+    s = str(v).strip()
+    # Normalize datetime-local -> ISO
+    if widget == "datetime":
+        try:
+            # HTML datetime-local gives 'YYYY-MM-DDTHH:MM'
+            dt = datetime.fromisoformat(s)
+            s = dt.isoformat()
+        except Exception:
+            pass
+    elif widget == "date":
+        try:
+            d = date.fromisoformat(s)
+            s = d.isoformat()
+        except Exception:
+            pass
+    return s
+
 async def memento_insert(request, datasette):
     db = datasette.get_database()
     table_raw = (getattr(request, 'url_vars', None) or request.scope.get('url_vars', {})).get('table')
     table = unquote(table_raw) if table_raw else None
     if not table:
         return Response.text('Missing table', status=400)
+    # the INSERT comes from insert_form's compiled plan (fixed SQL text, cached
+    # per schema_version); memento only maps its widgets to values
+    plan = await insert_form.get_plan(db, table)
+    if plan is None:
+        return Response.text(f"Unknown table: {table}", status=404)
     message = None
 
     # POST -> insert
     if request.method == "POST":
         form = await request.post_vars()
-        cols = await _get_column_meta(datasette, table)
-
-        names = []
-        values = []
-        for c in cols:
-            colname = c["name"]
-            if c["pk"]:
-                # do not force user to set PK
-                continue
-
-            if c["widget"] == "duration_hhmm":
-                v = _normalize_duration_inputs(form, colname)
-            elif c["widget"] == "checkbox":
-                v = 1 if form.get(colname) in ("on", "1", "true", "True") else 0
-            else:
-                v = form.get(colname)
-
-            if v is None or str(v).strip() == "":
-                values.append(None)
-            else:
-                s = str(v).strip()
-                # Normalize datetime-local -> ISO
-                if c["widget"] == "datetime":
-                    try:
-                        # HTML datetime-local gives 'YYYY-MM-DDTHH:MM'
-                        dt = datetime.fromisoformat(s)
-                        s = dt.isoformat()
-                    except Exception:
-                        pass
-                elif c["widget"] == "date":
-                    try:
-                        d = date.fromisoformat(s)
-                        s = d.isoformat()
-                    except Exception:
-                        pass
-                values.append(s)
-            names.append(colname)
-
-        if names:
-            sql = f'INSERT INTO {_q(table)} ({", ".join(_q(n) for n in names)}) VALUES ({", ".join(["?"]*len(names))})'
-            await db.execute_write(sql, values, block=True)
+        if plan["sql"]:
+            widgets = {c["name"]: c["widget"] for c in await _get_column_meta(datasette, table)}
+            values = [_memento_form_value(widgets.get(c["name"]), form, c["name"]) for c in plan["columns"]]
+            await db.execute_write(plan["sql"], values, block=True)
             try:
                 datasette.add_message(request, f"Record inserito in '{table}'.")
             except Exception:
@@ -644,6 +600,259 @@ async def memento_insert(request, datasette):
     html = await datasette.render_template("memento_insert.html", ctx, request=request)
     return Response.html(html)
 
+# ---- bulk JSON / NDJSON insert -------------------------------------------------
+
+BULK_CHUNK_ROWS = 500
+
+_BULK_CONTENT_TYPES = ("application/json", "application/x-ndjson", "application/ndjson")
+
+def _parse_bulk_body(body: bytes):
+    """Parse a JSON array (or single object) or NDJSON into a list of records.
+
+    Returns (records, errors); an NDJSON line that is not valid JSON becomes
+    a per-record error instead of failing the whole request.
+    """
+    text = body.decode("utf-8-sig").strip()
+    if not text:
+        return [], []
+    if text.startswith("["):
+        data = json.loads(text)
+        if not isinstance(data, list):
+            raise ValueError("expected a JSON array")
+        return data, []
+    try:
+        return [json.loads(text)], []
+    except ValueError:
+        pass
+    records, errors = [], []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            records.append(json.loads(line))
+        except ValueError as ex:
+            errors.append((len(records), f"invalid JSON: {ex}"))
+            records.append(None)
+    return records, errors
+
+def _bulk_insert(conn: sqlite3.Connection, table_name: str, batches, chunk_rows: int = BULK_CHUNK_ROWS):
+    """Insert {column tuple: [(index, values), ...]} groups; one transaction per chunk.
+
+    A chunk that fails is retried row by row so the error can be pinned to
+    its record. Returns (inserted, [(index, error), ...]).
+    """
+    inserted = 0
+    errors = []
+    for names, items in batches.items():
+        sql = (
+            f'INSERT INTO {_q(table_name)} ({", ".join(_q(n) for n in names)}) '
+            f'VALUES ({", ".join(["?"] * len(names))})'
+        )
+        for chunk in _iter_chunks(items, chunk_rows):
+            try:
+                with _transaction(conn):
+                    conn.executemany(sql, [vals for _, vals in chunk])
+                inserted += len(chunk)
+                continue
+            except sqlite3.Error:
+                pass
+            for i, vals in chunk:
+                try:
+                    with _transaction(conn):
+                        conn.execute(sql, vals)
+                    inserted += 1
+                except sqlite3.Error as ex:
+                    errors.append((i, str(ex)))
+    return inserted, errors
+
+async def memento_bulk(request, datasette):
+    """
+    POST /memento/<table>/bulk
+    Body: JSON array of {column: value} records, or NDJSON (one record per line).
+    Values are normalized like the CSV import (booleans, numbers, dates, H:MM).
+    """
+    if request.method != "POST":
+        return Response.json({"ok": False, "error": "POST only"}, status=405)
+    db = datasette.get_database()
+    table_raw = (getattr(request, 'url_vars', None) or request.scope.get('url_vars', {})).get('table')
+    table = unquote(table_raw) if table_raw else None
+    if not table or not await db.table_exists(table):
+        return Response.json({"ok": False, "error": f"Unknown table: {table}"}, status=404)
+
+    try:
+        records, errors = _parse_bulk_body(await request.post_body())
+    except ValueError as ex:
+        return Response.json({"ok": False, "error": f"Invalid body: {ex}"}, status=400)
+
+    cols = await _get_column_meta(datasette, table)
+    converters = {
+        c["name"]: _CONVERTERS.get(c["subtype"], _convert_text)
+        for c in cols
+    }
+    order = {c["name"]: i for i, c in enumerate(cols)}
+    failed = {i for i, _ in errors}
+
+    # group by column set so every executemany has a fixed column list
+    batches = {}
+    for i, rec in enumerate(records):
+        if i in failed:
+            continue
+        if not isinstance(rec, dict):
+            errors.append((i, "record must be a JSON object"))
+            continue
+        unknown = [k for k in rec if k not in converters]
+        if unknown:
+            errors.append((i, "unknown column(s): " + ", ".join(unknown)))
+            continue
+        names = tuple(sorted(rec, key=order.__getitem__))
+        vals = []
+        bad = None
+        for n in names:
+            v = rec[n]
+            if isinstance(v, (dict, list)):
+                bad = f"column {n}: nested values are not supported"
+                break
+            s = "" if v is None else str(v).strip()
+            vals.append(converters[n](s) if s else None)
+        if bad:
+            errors.append((i, bad))
+            continue
+        if names:
+            batches.setdefault(names, []).append((i, vals))
+
+    inserted, write_errors = await db.execute_write_fn(
+        lambda conn: _bulk_insert(conn, table, batches), block=True
+    )
+    errors.extend(write_errors)
+    errors.sort()
+    return Response.json({
+        "ok": not errors,
+        "table": table,
+        "received": len(records),
+        "inserted": inserted,
+        "errors": [{"index": i, "error": e} for i, e in errors],
+    })
+
+# ---- CSV export (round-trip with memento_csvs) --------------------------------
+
+EXPORT_CHUNK_ROWS = 1000
+
+def _export_boolean(v):
+    if isinstance(v, str):
+        v = _try_parse_bool(v) if v.strip() else None
+    return "" if v is None else ("true" if v else "false")
+
+def _export_duration(v):
+    if isinstance(v, (int, float)) and not isinstance(v, bool):
+        # minutes
+        m = int(v)
+        return f"{m // 60}:{m % 60:02d}"
+    d = _try_parse_duration_hhmm(str(v).strip())
+    return f"{d[0]}:{d[1]:02d}" if d else str(v)
+
+def _export_value(v):
+    return "" if v is None else str(v)
+
+_EXPORTERS = {
+    "boolean": _export_boolean,
+    "duration_hhmm": _export_duration,
+}
+
+def _export_date_as(fmt: str, parse):
+    # values that are not ISO (imported unparsed, or typed by hand) go out as-is
+    def export(v):
+        d = parse(v) if isinstance(v, str) else None
+        return d.strftime(fmt) if d else str(v)
+
+    return export
+
+def _column_exporter(col):
+    fmt = col.get("format")
+    if col["subtype"] in ("date", "datetime") and fmt and fmt != "iso":
+        return _export_date_as(fmt, _iso_date if col["subtype"] == "date" else _iso_datetime)
+    return _EXPORTERS.get(col["subtype"], _export_value)
+
+def _compile_row_exporter(cols):
+    exporters = tuple(_column_exporter(c) for c in cols)
+
+    def export(row):
+        return [("" if v is None else f(v)) for f, v in zip(exporters, row)]
+
+    return export
+
+async def memento_export_csv(request, datasette):
+    """
+    GET /memento/<table>/export.csv[?since=<rowid>]
+    Streams the table as a memento_csvs-style CSV: columns in table (i.e.
+    original CSV) order, every field quoted, booleans as true/false,
+    durations as H:MM and dates/datetimes in the format the column was
+    imported with (ISO when unknown), all of which the importer reads back.
+
+    Rows are read in rowid order, EXPORT_CHUNK_ROWS per query, so memory
+    stays constant. ``since`` exports only rows with a larger rowid; the
+    X-Memento-Last-Rowid header is the value to pass as ``since`` next time.
+    """
+    db = datasette.get_database()
+    table_raw = (getattr(request, 'url_vars', None) or request.scope.get('url_vars', {})).get('table')
+    table = unquote(table_raw) if table_raw else None
+    if not table or not await db.table_exists(table):
+        return Response.text(f"Unknown table: {table}", status=404)
+    since = request.args.get("since") or "0"
+    try:
+        since = int(since)
+    except ValueError:
+        return Response.text("since must be a rowid (integer)", status=400)
+
+    cols = await _get_column_meta(datasette, table)
+    try:
+        res = await db.execute(f"SELECT max(rowid) FROM {_q(table)}")
+    except Exception:
+        return Response.text(f"{table} has no rowid to export by", status=400)
+    # snapshot the end now, so rows added while streaming wait for the next sync
+    last_rowid = res.rows[0][0] or since
+    export = _compile_row_exporter(cols)
+    sql = (
+        f"SELECT rowid, {', '.join(_q(c['name']) for c in cols)} FROM {_q(table)} "
+        f"WHERE rowid > :after AND rowid <= :last ORDER BY rowid LIMIT {EXPORT_CHUNK_ROWS}"
+    )
+
+    async def stream_fn(r):
+        buf = io.StringIO()
+        writer = csv.writer(buf, quoting=csv.QUOTE_ALL, lineterminator="\n")
+        writer.writerow([c["name"] for c in cols])
+        after = since
+        while True:
+            rows = (await db.execute(sql, {"after": after, "last": last_rowid})).rows
+            for row in rows:
+                writer.writerow(export(tuple(row)[1:]))
+            await r.write(buf.getvalue())
+            buf.seek(0)
+            buf.truncate()
+            if len(rows) < EXPORT_CHUNK_ROWS:
+                break
+            after = rows[-1][0]
+
+    filename = quote(f"{table}.csv")
+    return AsgiStream(
+        stream_fn,
+        headers={
+            "content-disposition": f"attachment; filename*=UTF-8''{filename}",
+            "x-memento-last-rowid": str(last_rowid),
+            "cache-control": "no-store",
+        },
+        content_type="text/csv; charset=utf-8",
+    )
+
+@hookimpl
+def skip_csrf(datasette, scope):
+    # JSON/NDJSON bodies cannot be sent cross-site without a CORS preflight
+    if scope["type"] != "http" or not scope["path"].endswith("/bulk") or not scope["path"].startswith("/memento/"):
+        return False
+    headers = dict(scope.get("headers") or [])
+    content_type = headers.get(b"content-type", b"").split(b";", 1)[0].strip().decode("latin-1").lower()
+    return content_type in _BULK_CONTENT_TYPES
+
 @hookimpl
 def menu_links(datasette, actor, request):
     return [
@@ -4,6 +4,8 @@
 
 import json
 import os
+import hashlib
+import gzip
 import asyncio
 import sqlite3
 from datetime import datetime, timezone
@@ -21,6 +23,19 @@ SEED_JSON_CANDIDATES = [
 
 DB_OP_TIMEOUT = 2.0
 
+# /-/pillole/add: inserts are queued and committed together, one
+# transaction at most every FLUSH_INTERVAL seconds or FLUSH_MAX_ROWS rows
+FLUSH_INTERVAL = 0.05
+FLUSH_MAX_ROWS = 200
+
+# /-/pillole/stream: how often PRAGMA data_version is checked for writes made
+# outside this process, and the keep-alive comment interval for idle clients
+STREAM_PROBE_INTERVAL = 2.0
+STREAM_HEARTBEAT = 15.0
+# rows a slow client may fall behind before it is disconnected (it reconnects
+# with Last-Event-ID and catches up from the table)
+STREAM_QUEUE_MAX = 500
+
 
 def _now_iso():
     return datetime.now(timezone.utc).replace(microsecond=0).isoformat().replace("+00:00", "Z")
@@ -50,19 +65,24 @@ def _normalize_seed_payload(data):
     return out
 
 
-def _load_farmaci_seed_from_json():
+def _read_farmaci_seed():
+    """(path, sha256 of the file, normalized items) of the first usable seed JSON, or (None, None, [])."""
     for path in SEED_JSON_CANDIDATES:
         try:
             if not os.path.exists(path):
                 continue
-            with open(path, "r", encoding="utf-8") as f:
-                data = json.load(f)
-            out = _normalize_seed_payload(data)
+            with open(path, "rb") as f:
+                raw = f.read()
+            out = _normalize_seed_payload(json.loads(raw.decode("utf-8")))
             if out:
-                return out
+                return path, hashlib.sha256(raw).hexdigest(), out
         except Exception:
             pass
-    return []
+    return None, None, []
+
+
+def _load_farmaci_seed_from_json():
+    return _read_farmaci_seed()[2]
 
 
 async def _get_db(datasette):
@@ -88,7 +108,17 @@ async def _ensure_tables(datasette):
         """
     )
     await _exec("CREATE INDEX IF NOT EXISTS idx_pillole_quando ON pillole(quando)")
-    await _exec("CREATE INDEX IF NOT EXISTS idx_pillole_farmaco ON pillole(farmaco)")
+    # client-generated ids of /-/pillole/sync (and optionally /-/pillole/add):
+    # the unique index makes retried submissions idempotent; NULLs never clash
+    info = await db.execute("PRAGMA table_info(pillole)")
+    if "uuid" not in {r[1] for r in info.rows}:
+        await _exec("ALTER TABLE pillole ADD COLUMN uuid TEXT")
+    await _exec("CREATE UNIQUE INDEX IF NOT EXISTS idx_pillole_uuid ON pillole(uuid)")
+
+    # per-drug history in quando order; also serves every farmaco = ? lookup,
+    # which makes the old single-column index redundant
+    await _exec("CREATE INDEX IF NOT EXISTS idx_pillole_farmaco_quando ON pillole(farmaco, quando)")
+    await _exec("DROP INDEX IF EXISTS idx_pillole_farmaco")
 
     await _exec(
         """
@@ -99,6 +129,83 @@ async def _ensure_tables(datasette):
         """
     )
 
+    await _exec(
+        """
+        CREATE TABLE IF NOT EXISTS "__pillole_seed_state" (
+            source TEXT PRIMARY KEY,
+            sha256 TEXT NOT NULL,
+            seeded_at TEXT
+        )
+        """
+    )
+
+    # no timeout: the first run backfills the whole history
+    await db.execute_write_fn(_ensure_daily_rollup, block=True)
+
+
+# pillole_daily: per (day, farmaco) count and dose total, kept in step with
+# pillole by triggers (so writes from any process are counted). day is the
+# date part of quando.
+_DAILY_TRIGGERS = {
+    "pillole_daily_ai": """
+        CREATE TRIGGER IF NOT EXISTS pillole_daily_ai AFTER INSERT ON pillole BEGIN
+            INSERT INTO pillole_daily (day, farmaco, n, dose_sum)
+            VALUES (substr(NEW.quando, 1, 10), NEW.farmaco, 1, coalesce(NEW.dose, 0))
+            ON CONFLICT(day, farmaco) DO UPDATE
+            SET n = n + 1, dose_sum = dose_sum + excluded.dose_sum;
+        END
+    """,
+    "pillole_daily_ad": """
+        CREATE TRIGGER IF NOT EXISTS pillole_daily_ad AFTER DELETE ON pillole BEGIN
+            UPDATE pillole_daily SET n = n - 1, dose_sum = dose_sum - coalesce(OLD.dose, 0)
+            WHERE day = substr(OLD.quando, 1, 10) AND farmaco = OLD.farmaco;
+            DELETE FROM pillole_daily
+            WHERE day = substr(OLD.quando, 1, 10) AND farmaco = OLD.farmaco AND n <= 0;
+        END
+    """,
+    "pillole_daily_au": """
+        CREATE TRIGGER IF NOT EXISTS pillole_daily_au AFTER UPDATE OF quando, farmaco, dose ON pillole BEGIN
+            UPDATE pillole_daily SET n = n - 1, dose_sum = dose_sum - coalesce(OLD.dose, 0)
+            WHERE day = substr(OLD.quando, 1, 10) AND farmaco = OLD.farmaco;
+            DELETE FROM pillole_daily
+            WHERE day = substr(OLD.quando, 1, 10) AND farmaco = OLD.farmaco AND n <= 0;
+            INSERT INTO pillole_daily (day, farmaco, n, dose_sum)
+            VALUES (substr(NEW.quando, 1, 10), NEW.farmaco, 1, coalesce(NEW.dose, 0))
+            ON CONFLICT(day, farmaco) DO UPDATE
+            SET n = n + 1, dose_sum = dose_sum + excluded.dose_sum;
+        END
+    """,
+}
+
+
+def _ensure_daily_rollup(conn):
+    """Create pillole_daily and its triggers; backfill it in the same transaction the first time."""
+    with conn:
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'pillole_daily'"
+        ).fetchone()
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS pillole_daily (
+                day TEXT NOT NULL,
+                farmaco TEXT NOT NULL,
+                n INTEGER NOT NULL,
+                dose_sum REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (day, farmaco)
+            ) WITHOUT ROWID
+            """
+        )
+        if not exists:
+            conn.execute(
+                """
+                INSERT INTO pillole_daily (day, farmaco, n, dose_sum)
+                SELECT substr(quando, 1, 10), farmaco, count(*), total(dose)
+                FROM pillole GROUP BY 1, 2
+                """
+            )
+        for sql in _DAILY_TRIGGERS.values():
+            conn.execute(sql)
+
 
 def _to_float(v):
     if v is None:
@@ -117,27 +224,51 @@ def _to_float(v):
 
 
 async def _seed_farmaci_defaults(datasette):
+    """
+    Upsert pillole_farmaci from the seed JSON in one write transaction.
+
+    Skipped entirely when the file's sha256 matches the last seed recorded
+    in __pillole_seed_state; otherwise only entries that are missing or
+    whose dose_default differs are written (entries are never deleted).
+    """
     db = await _get_db(datasette)
-    seed = _load_farmaci_seed_from_json()
+    path, sha, seed = _read_farmaci_seed()
     if not seed:
         return
+    source = os.path.relpath(path, BASE_DIR)
 
+    state = await db.execute('SELECT sha256 FROM "__pillole_seed_state" WHERE source = ?', [source])
+    if state.rows and state.rows[0][0] == sha:
+        return
+
+    existing = {
+        r[0]: r[1]
+        for r in (await db.execute("SELECT farmaco, dose_default FROM pillole_farmaci")).rows
+    }
+    changed = []
     for x in seed:
-        try:
-            await asyncio.wait_for(
-                db.execute_write(
-                    """
-                    INSERT INTO pillole_farmaci (farmaco, dose_default)
-                    VALUES (?, ?)
-                    ON CONFLICT(farmaco) DO UPDATE
-                    SET dose_default = excluded.dose_default
-                    """,
-                    [x["farmaco"], _to_float(x.get("dose_default"))],
-                ),
-                timeout=DB_OP_TIMEOUT,
+        dose = _to_float(x.get("dose_default"))
+        if x["farmaco"] not in existing or existing[x["farmaco"]] != dose:
+            changed.append((x["farmaco"], dose))
+            existing[x["farmaco"]] = dose
+
+    def write(conn):
+        with conn:
+            conn.executemany(
+                """
+                INSERT INTO pillole_farmaci (farmaco, dose_default)
+                VALUES (?, ?)
+                ON CONFLICT(farmaco) DO UPDATE
+                SET dose_default = excluded.dose_default
+                """,
+                changed,
             )
-        except Exception:
-            pass
+            conn.execute(
+                'INSERT OR REPLACE INTO "__pillole_seed_state" (source, sha256, seeded_at) VALUES (?, ?, ?)',
+                [source, sha, _now_iso()],
+            )
+
+    await db.execute_write_fn(write, block=True)
 
 
 async def _cache_farmaci_list(datasette):
@@ -176,6 +307,190 @@ def _coerce_dose(v):
     return _to_float(v)
 
 
+class _InsertQueue:
+    """
+    Coalescing writer for pillole rows.
+
+    submit() queues one row and waits for the transaction that contains it:
+    the result is (rowid, created) - created is False when a row with the
+    same uuid already existed - or the sqlite error raised for that row.
+    A single flusher task drains the queue, so concurrent adds share one
+    commit (and one fsync) instead of queueing one write each.
+    """
+
+    def __init__(self, db, interval=FLUSH_INTERVAL, max_rows=FLUSH_MAX_ROWS, on_commit=None):
+        self.db = db
+        self.on_commit = on_commit
+        self.interval = interval
+        self.max_rows = max_rows
+        self._pending = []
+        self._full = asyncio.Event()
+        self._task = None
+
+    async def submit(self, quando, farmaco, dose, uuid=None):
+        fut = asyncio.get_running_loop().create_future()
+        self._pending.append(((quando, farmaco, dose, uuid), fut))
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+        if len(self._pending) >= self.max_rows:
+            self._full.set()
+        return await fut
+
+    async def _run(self):
+        while self._pending:
+            if len(self._pending) < self.max_rows:
+                try:
+                    await asyncio.wait_for(self._full.wait(), timeout=self.interval)
+                except asyncio.TimeoutError:
+                    pass
+            self._full.clear()
+            batch = self._pending[: self.max_rows]
+            del self._pending[: self.max_rows]
+            try:
+                results = await self.db.execute_write_fn(
+                    lambda conn: self._write(conn, [row for row, _ in batch]), block=True
+                )
+            except Exception as e:
+                results = [e] * len(batch)
+            committed = []
+            for (row, fut), res in zip(batch, results):
+                if not isinstance(res, Exception) and res[1]:
+                    committed.append(_dose_row(res[0], *row))
+                if fut.done():
+                    continue
+                if isinstance(res, Exception):
+                    fut.set_exception(res)
+                else:
+                    fut.set_result(res)
+            if committed and self.on_commit:
+                self.on_commit(committed)
+
+    @staticmethod
+    def _write(conn, rows):
+        # one transaction; a failing row only rolls back its own statement
+        results = []
+        with conn:
+            for row in rows:
+                try:
+                    results.append(_insert_dose(conn, *row))
+                except sqlite3.Error as e:
+                    results.append(e)
+        return results
+
+
+def _insert_dose(conn, quando, farmaco, dose, uuid=None):
+    """Insert one dose; returns (rowid, created). A known uuid returns the existing row."""
+    cur = conn.execute(
+        "INSERT INTO pillole (quando, farmaco, dose, uuid) VALUES (?, ?, ?, ?) ON CONFLICT(uuid) DO NOTHING",
+        [quando, farmaco, dose, uuid],
+    )
+    if cur.rowcount:
+        return cur.lastrowid, True
+    return conn.execute("SELECT rowid FROM pillole WHERE uuid = ?", [uuid]).fetchone()[0], False
+
+
+def _dose_row(rowid, quando, farmaco, dose, uuid=None):
+    return {"rowid": rowid, "quando": quando, "farmaco": farmaco, "dose": dose, "uuid": uuid}
+
+
+async def _get_writer(datasette):
+    writer = getattr(datasette, "_pillole_writer", None)
+    if writer is None:
+        hub = await _get_hub(datasette)
+        writer = datasette._pillole_writer = _InsertQueue(await _get_db(datasette), on_commit=hub.publish)
+    return writer
+
+
+class _StreamHub:
+    """
+    Fan-out of newly committed pillole rows to /-/pillole/stream clients.
+
+    Rows arrive from the insert queue right after their commit and, while
+    anyone is listening, from a PRAGMA data_version probe that notices
+    commits made by other processes. Both paths go through publish(), which
+    only forwards rowids above the last one sent, so nothing is sent twice.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.last_rowid = None
+        self._clients = set()
+        self._probe = None
+        self._conn = None
+
+    async def subscribe(self):
+        if self.last_rowid is None:
+            self.last_rowid = await self._max_rowid()
+        q = asyncio.Queue(maxsize=STREAM_QUEUE_MAX)
+        self._clients.add(q)
+        if self.db.path and (self._probe is None or self._probe.done()):
+            self._probe = asyncio.ensure_future(self._probe_loop())
+        return q
+
+    def unsubscribe(self, q):
+        self._clients.discard(q)
+
+    def publish(self, rows):
+        if self.last_rowid is None:
+            # nobody ever subscribed: nothing to send, nothing to remember
+            return
+        rows = [r for r in rows if r["rowid"] > self.last_rowid]
+        if not rows:
+            return
+        self.last_rowid = max(r["rowid"] for r in rows)
+        for q in list(self._clients):
+            try:
+                q.put_nowait(rows)
+            except asyncio.QueueFull:
+                # too far behind: end its stream (None), EventSource
+                # reconnects and resumes from Last-Event-ID
+                self._clients.discard(q)
+                while not q.empty():
+                    q.get_nowait()
+                q.put_nowait(None)
+
+    async def _max_rowid(self):
+        try:
+            res = await self.db.execute("SELECT max(rowid) FROM pillole")
+            return res.rows[0][0] or 0
+        except Exception:
+            return 0
+
+    def _data_version(self):
+        # data_version is per connection: keep one private connection for it
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db.path)
+        return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    async def _probe_loop(self):
+        try:
+            version = self._data_version()
+            while self._clients:
+                await asyncio.sleep(STREAM_PROBE_INTERVAL)
+                current = self._data_version()
+                if current == version:
+                    continue
+                version = current
+                res = await self.db.execute(
+                    "SELECT rowid, quando, farmaco, dose, uuid FROM pillole WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                    [self.last_rowid, STREAM_QUEUE_MAX],
+                )
+                self.publish([dict(r) for r in res.rows])
+        except Exception:
+            pass
+        finally:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+async def _get_hub(datasette):
+    hub = getattr(datasette, "_pillole_hub", None)
+    if hub is None:
+        hub = datasette._pillole_hub = _StreamHub(await _get_db(datasette))
+    return hub
+
+
 async def pillole_add(request, datasette):
     """
     POST /-/pillole/add
@@ -208,78 +523,410 @@ async def pillole_add(request, datasette):
 
     dose = _coerce_dose(payload.get("dose"))
     quando = str(payload.get("quando") or "").strip() or _now_iso()
+    uuid = str(payload.get("uuid") or "").strip() or None
 
-    db = await _get_db(datasette)
+    # no timeout here: the answer is the outcome of the commit, however long it queued
+    writer = await _get_writer(datasette)
     try:
-        await asyncio.wait_for(
-            db.execute_write(
-                "INSERT INTO pillole (quando, farmaco, dose) VALUES (?, ?, ?)",
-                [quando, farmaco, dose],
-            ),
-            timeout=DB_OP_TIMEOUT,
-        )
+        rowid, created = await writer.submit(quando, farmaco, dose, uuid)
     except Exception as e:
         return Response.json({"ok": False, "error": str(e)}, status=500)
 
-    return Response.json({"ok": True, "quando": quando})
+    return Response.json({"ok": True, "quando": quando, "rowid": rowid, "duplicate": not created})
 
 
-async def pillole_recent(request, datasette):
+# rows returned per /-/pillole/sync response; "more" asks the client to sync again
+SYNC_MAX_ROWS = 1000
+
+
+def _sync_write(conn, doses):
+    results = []
+    created = []
+    with conn:
+        for d in doses:
+            if "error" in d:
+                results.append({"uuid": d.get("uuid"), "status": "error", "error": d["error"]})
+                continue
+            row = (d["quando"], d["farmaco"], d["dose"], d["uuid"])
+            try:
+                rowid, new = _insert_dose(conn, *row)
+            except sqlite3.Error as e:
+                results.append({"uuid": d["uuid"], "status": "error", "error": str(e)})
+                continue
+            results.append({"uuid": d["uuid"], "rowid": rowid, "status": "created" if new else "duplicate"})
+            if new:
+                created.append(_dose_row(rowid, *row))
+    return results, created
+
+
+def _parse_since(v) -> int:
+    """The sync token: a rowid, sent as a JSON integer or a string of digits (missing = 0)."""
+    if v is None or v == "":
+        return 0
+    if isinstance(v, bool) or not isinstance(v, (int, str)):
+        raise ValueError("since must be a token string")
+    try:
+        n = int(v)
+    except ValueError:
+        raise ValueError("since must be a token string") from None
+    if not 0 <= n < 2 ** 63:
+        raise ValueError("since out of range")
+    return n
+
+
+async def pillole_sync(request, datasette):
+    """
+    POST /-/pillole/sync
+    Body: {"since": "<token>", "doses": [{"uuid", "farmaco", "dose", "quando"}, ...]}
+    Stores the doses in one transaction, deduplicated by uuid (resending a
+    batch is harmless), then returns every row committed after ``since``
+    in rowid order, with the ``token`` to send as ``since`` next time.
+    """
+    if request.method != "POST":
+        return Response.json({"ok": False, "error": "POST only"}, status=405)
+    try:
+        payload = json.loads((await request.post_body()).decode("utf-8") or "{}")
+        if not isinstance(payload, dict):
+            raise ValueError("body must be a JSON object")
+        since = _parse_since(payload.get("since"))
+        items = payload.get("doses") or []
+        if not isinstance(items, list):
+            raise ValueError("doses must be a list")
+    except ValueError as e:
+        return Response.json({"ok": False, "error": f"Invalid body: {e}"}, status=400)
+
+    doses = []
+    for x in items:
+        x = x if isinstance(x, dict) else {}
+        uuid = str(x.get("uuid") or "").strip()
+        farmaco = str(x.get("farmaco") or "").strip()
+        if not uuid or not farmaco:
+            doses.append({"uuid": uuid or None, "error": "uuid and farmaco are required"})
+            continue
+        doses.append({
+            "uuid": uuid,
+            "farmaco": farmaco,
+            "dose": _coerce_dose(x.get("dose")),
+            "quando": str(x.get("quando") or "").strip() or _now_iso(),
+        })
+
     db = await _get_db(datasette)
-    limit = min(max(int(request.args.get("limit", 30)), 1), 500)
+    results, created = [], []
+    if doses:
+        try:
+            results, created = await db.execute_write_fn(lambda conn: _sync_write(conn, doses), block=True)
+        except Exception as e:
+            return Response.json({"ok": False, "error": str(e)}, status=500)
+        if created:
+            (await _get_hub(datasette)).publish(created)
+
+    res = await db.execute(
+        "SELECT rowid, quando, farmaco, dose, uuid FROM pillole WHERE rowid > ? ORDER BY rowid LIMIT ?",
+        [since, SYNC_MAX_ROWS + 1],
+    )
+    rows = [dict(r) for r in res.rows[:SYNC_MAX_ROWS]]
+    return Response.json({
+        "ok": all(r["status"] != "error" for r in results),
+        "results": results,
+        "rows": rows,
+        "token": str(rows[-1]["rowid"] if rows else since),
+        "more": len(res.rows) > SYNC_MAX_ROWS,
+    })
+
+
+def _sse_rows(rows):
+    return "".join(
+        f"id: {r['rowid']}\ndata: {json.dumps(r, ensure_ascii=False)}\n\n" for r in rows
+    ).encode("utf-8")
+
+
+async def _wait_disconnect(receive):
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return
+
 
+async def pillole_stream(request, datasette, send, receive):
+    """
+    GET /-/pillole/stream
+    Server-sent events: one message per new pillole row (id = rowid,
+    data = {rowid, quando, farmaco, dose}). A reconnecting EventSource sends
+    Last-Event-ID and first receives the rows it missed.
+    """
+    hub = await _get_hub(datasette)
+    q = await hub.subscribe()
+    # rows after this one reach q; older ones can only come from the table
+    upto = hub.last_rowid
+    disconnected = asyncio.ensure_future(_wait_disconnect(receive))
     try:
-        res = await asyncio.wait_for(
-            db.execute(
-                """
-                SELECT quando, farmaco, dose
-                FROM pillole
-                ORDER BY quando DESC
-                LIMIT ?
-                """,
-                [limit],
-            ),
-            timeout=DB_OP_TIMEOUT,
-        )
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                [b"content-type", b"text/event-stream; charset=utf-8"],
+                [b"cache-control", b"no-cache"],
+                [b"x-accel-buffering", b"no"],
+            ],
+        })
+        body = b"retry: 3000\n\n"
+        last_id = request.headers.get("last-event-id", "")
+        if last_id.isdigit():
+            db = await _get_db(datasette)
+            res = await db.execute(
+                "SELECT rowid, quando, farmaco, dose, uuid FROM pillole WHERE rowid > ? AND rowid <= ? ORDER BY rowid LIMIT ?",
+                [int(last_id), upto, STREAM_QUEUE_MAX],
+            )
+            body += _sse_rows([dict(r) for r in res.rows])
+        await send({"type": "http.response.body", "body": body, "more_body": True})
+
+        while not disconnected.done():
+            getter = asyncio.ensure_future(q.get())
+            done, _ = await asyncio.wait(
+                {getter, disconnected}, timeout=STREAM_HEARTBEAT, return_when=asyncio.FIRST_COMPLETED
+            )
+            if getter not in done:
+                getter.cancel()
+                if not disconnected.done():
+                    await send({"type": "http.response.body", "body": b": ping\n\n", "more_body": True})
+                continue
+            rows = getter.result()
+            if rows is None:
+                break
+            await send({"type": "http.response.body", "body": _sse_rows(rows), "more_body": True})
+        if not disconnected.done():
+            await send({"type": "http.response.body", "body": b""})
+    finally:
+        hub.unsubscribe(q)
+        disconnected.cancel()
+
+
+async def pillole_recent(request, datasette):
+    """
+    GET /-/pillole/recent.json?limit=&before=<quando>,<rowid>&from=&to=&farmaco=
+    Newest first, ordered by (quando, rowid). ``next`` is the ``before``
+    cursor of the following page (null on the last one), so every page is
+    an index range scan of at most ``limit`` rows however deep it is.
+    from/to bound quando (inclusive; a bare date for ``to`` covers that day).
+    """
+    db = await _get_db(datasette)
+    try:
+        limit = min(max(int(request.args.get("limit", 30)), 1), 500)
+    except ValueError:
+        return Response.json({"ok": False, "error": "limit must be an integer"}, status=400)
+
+    where = []
+    params = {"limit": limit}
+    before = (request.args.get("before") or "").strip()
+    if before:
+        quando, _, rowid = before.rpartition(",")
+        try:
+            params["b_rowid"] = int(rowid)
+        except ValueError:
+            return Response.json({"ok": False, "error": "before must be <quando>,<rowid>"}, status=400)
+        params["b_quando"] = quando
+        where.append("(quando, rowid) < (:b_quando, :b_rowid)")
+    v = (request.args.get("from") or "").strip()
+    if v:
+        where.append("quando >= :from")
+        params["from"] = v
+    v = (request.args.get("to") or "").strip()
+    if v:
+        # "2025-03-01" must include "2025-03-01T23:00:00Z"
+        where.append("quando <= :to" if len(v) > 10 else "quando < date(:to, '+1 day')")
+        params["to"] = v
+    v = (request.args.get("farmaco") or "").strip()
+    if v:
+        where.append("farmaco = :farmaco")
+        params["farmaco"] = v
+
+    sql = (
+        "SELECT rowid, quando, farmaco, dose, uuid FROM pillole "
+        + (("WHERE " + " AND ".join(where) + " ") if where else "")
+        + "ORDER BY quando DESC, rowid DESC LIMIT :limit"
+    )
+    try:
+        res = await asyncio.wait_for(db.execute(sql, params), timeout=DB_OP_TIMEOUT)
         rows = [dict(r) for r in res.rows]
     except Exception:
         rows = []
 
-    return Response.json({"ok": True, "rows": rows})
+    nxt = None
+    if len(rows) == limit:
+        nxt = f"{rows[-1]['quando']},{rows[-1]['rowid']}"
+    return Response.json({"ok": True, "rows": rows, "next": nxt})
 
 
-async def pillole_defaults(request, datasette):
+# group= of /-/pillole/stats.json -> SQL for the period a pillole_daily.day falls in
+_STATS_PERIODS = {
+    "day": "day",
+    # the Monday of day's week
+    "week": "date(day, '-6 days', 'weekday 1')",
+    "month": "substr(day, 1, 7)",
+}
+
+
+async def pillole_stats(request, datasette):
+    """
+    GET /-/pillole/stats.json?from=YYYY-MM-DD&to=YYYY-MM-DD&farmaco=...&group=day|week|month
+    Doses per period and farmaco from the pillole_daily rollup (from/to inclusive, all optional).
+    """
+    group = request.args.get("group") or "day"
+    if group not in _STATS_PERIODS:
+        return Response.json({"ok": False, "error": "group must be day, week or month"}, status=400)
+
+    where = []
+    params = {}
+    for arg, op in (("from", ">="), ("to", "<=")):
+        v = (request.args.get(arg) or "").strip()
+        if v:
+            where.append(f"day {op} :{arg}")
+            params[arg] = v[:10]
+    farmaco = (request.args.get("farmaco") or "").strip()
+    if farmaco:
+        where.append("farmaco = :farmaco")
+        params["farmaco"] = farmaco
+
+    period = _STATS_PERIODS[group]
+    sql = (
+        f"SELECT {period} AS period, farmaco, sum(n) AS n, sum(dose_sum) AS dose_sum "
+        "FROM pillole_daily "
+        + (("WHERE " + " AND ".join(where) + " ") if where else "")
+        + "GROUP BY 1, 2 ORDER BY 1, 2"
+    )
     db = await _get_db(datasette)
     try:
-        res = await asyncio.wait_for(
-            db.execute(
-                "SELECT farmaco, dose_default FROM pillole_farmaci ORDER BY farmaco"
-            ),
-            timeout=DB_OP_TIMEOUT,
-        )
-        rows = [dict(r) for r in res.rows]
-    except Exception:
-        rows = _load_farmaci_seed_from_json()
+        res = await asyncio.wait_for(db.execute(sql, params), timeout=DB_OP_TIMEOUT)
+    except Exception as e:
+        return Response.json({"ok": False, "error": str(e)}, status=500)
 
-    return Response.json({"ok": True, "rows": rows})
+    return Response.json({"ok": True, "group": group, "rows": [dict(r) for r in res.rows]})
+
+
+# bodies smaller than this are not worth a gzip variant
+GZIP_MIN_BYTES = 512
+
+# {path: ((mtime_ns, size), entry)} for files served by this plugin
+_FILE_CACHE = {}
+
+
+def _cached_body(body, content_type):
+    """Response body plus its strong ETag and, when it pays off, a pre-gzipped variant."""
+    etag = '"%s"' % hashlib.sha256(body).hexdigest()[:32]
+    gz = None
+    if len(body) >= GZIP_MIN_BYTES:
+        gz = gzip.compress(body, 9, mtime=0)
+        if len(gz) >= len(body):
+            gz = None
+    return {
+        "body": body,
+        "gzip": gz,
+        "etag": etag,
+        "etag_gzip": etag[:-1] + '-gz"',
+        "content_type": content_type,
+    }
+
+
+def _etag_matches(header, etags):
+    for tag in header.split(","):
+        tag = tag.strip()
+        if tag == "*":
+            return True
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag in etags:
+            return True
+    return False
+
+
+def _conditional_response(request, entry, cache_control="no-cache"):
+    """200 with the (gzipped when accepted) body, or 304 when If-None-Match matches."""
+    use_gzip = entry["gzip"] is not None and "gzip" in request.headers.get("accept-encoding", "")
+    headers = {
+        "etag": entry["etag_gzip"] if use_gzip else entry["etag"],
+        "cache-control": cache_control,
+        "vary": "Accept-Encoding",
+    }
+    inm = request.headers.get("if-none-match")
+    if inm and _etag_matches(inm, (entry["etag"], entry["etag_gzip"])):
+        return Response(b"", status=304, headers=headers)
+    if use_gzip:
+        headers["content-encoding"] = "gzip"
+        return Response(entry["gzip"], headers=headers, content_type=entry["content_type"])
+    return Response(entry["body"], headers=headers, content_type=entry["content_type"])
+
+
+def _file_entry(path, content_type, missing):
+    """Cached body of path, rebuilt when its (mtime_ns, size) changes."""
+    try:
+        st = os.stat(path)
+        key = (st.st_mtime_ns, st.st_size)
+    except OSError:
+        key = None
+    cached = _FILE_CACHE.get(path)
+    if cached and cached[0] == key:
+        return cached[1]
+    body = missing
+    if key is not None:
+        try:
+            with open(path, "rb") as f:
+                body = f.read()
+        except OSError:
+            key = None
+    entry = _cached_body(body, content_type)
+    _FILE_CACHE[path] = (key, entry)
+    return entry
+
+
+def _data_version(datasette, db):
+    """PRAGMA data_version on a private connection: changes whenever another connection commits."""
+    if not db.path:
+        return None
+    conn = getattr(datasette, "_pillole_version_conn", None)
+    if conn is None:
+        conn = datasette._pillole_version_conn = sqlite3.connect(db.path)
+    return conn.execute("PRAGMA data_version").fetchone()[0]
+
+
+async def pillole_defaults(request, datasette):
+    # rebuilt only after a commit to the database (by anyone); an unchanged
+    # pillole_farmaci keeps its ETag either way
+    db = await _get_db(datasette)
+    version = _data_version(datasette, db)
+    cached = getattr(datasette, "_pillole_defaults_cache", None)
+    if cached is None or version is None or cached[0] != version:
+        try:
+            res = await asyncio.wait_for(
+                db.execute(
+                    "SELECT farmaco, dose_default FROM pillole_farmaci ORDER BY farmaco"
+                ),
+                timeout=DB_OP_TIMEOUT,
+            )
+            rows = [dict(r) for r in res.rows]
+            if rows:
+                datasette._pillole_farmaci = rows
+        except Exception:
+            rows = _load_farmaci_seed_from_json()
+        body = json.dumps({"ok": True, "rows": rows}, default=repr).encode("utf-8")
+        cached = datasette._pillole_defaults_cache = (version, _cached_body(body, "application/json; charset=utf-8"))
+
+    return _conditional_response(request, cached[1])
 
 
 async def pillole_js(request, datasette):
     path = os.path.join(BASE_DIR, "static", "custom", "pillole.js")
-    try:
-        with open(path, "r", encoding="utf-8") as f:
-            body = f.read()
-    except Exception:
-        body = "// pillole.js not found"
-
-    return Response(body, headers={"content-type": "application/javascript; charset=utf-8"})
+    entry = _file_entry(path, "application/javascript; charset=utf-8", b"// pillole.js not found")
+    return _conditional_response(request, entry)
 
 
 @hookimpl
 def register_routes():
     return [
         (r"^/-/pillole/add$", pillole_add),
+        (r"^/-/pillole/sync$", pillole_sync),
         (r"^/-/pillole/recent\.json$", pillole_recent),
+        (r"^/-/pillole/stream$", pillole_stream),
+        (r"^/-/pillole/stats\.json$", pillole_stats),
         (r"^/-/pillole/defaults\.json$", pillole_defaults),
         (r"^/-/pillole/pillole\.js$", pillole_js),
     ]
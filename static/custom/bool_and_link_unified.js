@@ -28,7 +28,9 @@
   //   tabella.col3
   // Restituisce: { tabella -> Set{col1, col2, col3} } tutto in lowercase
   async function loadMap(relUrl) {
-    const txt = await fetchTextMulti(customPaths(relUrl));
+    const txt = await window.configText(relUrl.split("/").pop(), () =>
+      fetchTextMulti(customPaths(relUrl))
+    );
     if (!txt) return {};
     const map = {};
     const lines = txt
@@ -19,12 +19,14 @@
   // Colonne UI/sistema di Datasette che non devono MAI diventare booleane
   const ALWAYS_SKIP_COLS = new Set(["link", "rowid"]);
 
-  // Carica esclusioni da /custom/not_booleans.txt (supporta 2 formati)
+  // Carica esclusioni da not_booleans.txt (supporta 2 formati)
   async function loadNotBooleans(){
     try{
-      const res = await fetch("/custom/not_booleans.txt", {cache:"no-store"});
-      if(!res.ok) return {};
-      const txt = await res.text();
+      const txt = await window.configText("not_booleans.txt", async () => {
+        const res = await fetch("/custom/not_booleans.txt", {cache:"no-store"});
+        return res.ok ? res.text() : null;
+      });
+      if(!txt) return {};
       const lines = txt.split(/\r?\n/).map(s=>s.trim()).filter(Boolean);
       const map = {}; // {table -> Set(cols)}
       for(const line of lines){
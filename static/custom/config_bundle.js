@@ -0,0 +1,15 @@
+/* config_bundle.js — shared access to the /-/config.json bundle.
+ * Loaded once, without defer, from base.html: the other scripts call
+ * window.configText(name, fallback) to read a config file's text. The bundle
+ * is fetched once per page (304 when nothing changed); if it is unavailable
+ * or lacks the file, the fallback loader is used instead. */
+(function(){
+  window.configText = function(name, fallback){
+    window.__configBundle ||= fetch("/-/config.json")
+      .then((r) => (r.ok ? r.json() : null))
+      .catch(() => null);
+    return window.__configBundle.then((b) =>
+      b && b.files && name in b.files ? b.files[name].text : fallback()
+    );
+  };
+})();
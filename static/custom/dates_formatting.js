@@ -32,9 +32,11 @@
   // Wildcards allowed via '*'. Special table name '*' applies to all.
   async function loadRules() {
     try {
-      const res = await fetch("/custom/timestamp_columns.txt", { cache: "no-store" });
-      if (!res.ok) return [];
-      const txt = await res.text();
+      const txt = await window.configText("timestamp_columns.txt", async () => {
+        const res = await fetch("/custom/timestamp_columns.txt", { cache: "no-store" });
+        return res.ok ? res.text() : null;
+      });
+      if (!txt) return [];
       const rules = [];
       txt.split(/\r?\n/).forEach((line) => {
         const s = line.trim();
@@ -4,9 +4,11 @@
   // Load config maps from files that accept either "table.column" or "table: col1, col2"
   async function loadMap(url){
     try{
-      const r = await fetch(url, {cache:"no-store"});
-      if(!r.ok) return {};
-      const txt = await r.text();
+      const txt = await window.configText(url.split("/").pop(), async () => {
+        const r = await fetch(url, {cache:"no-store"});
+        return r.ok ? r.text() : null;
+      });
+      if(!txt) return {};
       const map = {};
       const lines = txt.split(/\r?\n/).map(s=>s.trim()).filter(Boolean);
       for(const line of lines){
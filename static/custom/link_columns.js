@@ -22,7 +22,7 @@
   }
   async function loadLinkSpec() {
     try {
-      const txt = await fetchTextMulti(customPaths("custom/link_columns.txt"));
+      const txt = await window.configText("link_columns.txt", () => fetchTextMulti(customPaths("custom/link_columns.txt")));
       if (!txt) return new Set();
       const set = new Set();
       txt.split(/\r?\n/).forEach(line => {
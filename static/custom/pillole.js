@@ -1,6 +1,7 @@
-// v18
+// v19
 // static/custom/pillole.js
 // Pillole UI: robust POST + visible debug log, no AbortController.
+// v19: live updates from /-/pillole/stream (SSE) instead of re-fetching recent.json.
 
 (function () {
   "use strict";
@@ -114,6 +115,30 @@
       .replaceAll("'", "&#039;");
   }
 
+  const RECENT_MAX = 30;
+  let recentRows = [];
+  let streamOpen = false;
+
+  function mergeRecent(rows) {
+    const seen = new Set(recentRows.map((r) => r.rowid).filter((x) => x !== undefined));
+    for (const r of rows) {
+      if (r.rowid === undefined || !seen.has(r.rowid)) recentRows.push(r);
+    }
+    recentRows.sort((a, b) => String(b.quando ?? "").localeCompare(String(a.quando ?? "")));
+    recentRows = recentRows.slice(0, RECENT_MAX);
+    renderRecent(recentRows);
+  }
+
+  function openStream(urls) {
+    if (!urls.stream || typeof EventSource === "undefined") return;
+    const es = new EventSource(urls.stream, { withCredentials: true });
+    es.onopen = () => { streamOpen = true; log(`stream aperto → ${urls.stream}`); };
+    es.onerror = () => { streamOpen = false; };
+    es.onmessage = (ev) => {
+      try { mergeRecent([JSON.parse(ev.data)]); } catch (e) { log(`ERRORE stream: ${e.message || e}`); }
+    };
+  }
+
   async function fetchRecent(urls) {
     try {
       log(`GET recent → ${urls.recent}`);
@@ -125,7 +150,8 @@
         throw new Error(`recent non-JSON (${ct}): ${t.slice(0, 160)}`);
       }
       const j = await r.json();
-      renderRecent(j.rows || []);
+      recentRows = [];
+      mergeRecent(j.rows || []);
     } catch (e) {
       log(`ERRORE recent: ${e && e.message ? e.message : String(e)}`);
     }
@@ -178,7 +204,8 @@
       try {
         await postAdd(urls, farmaco, dose);
         log(`OK farmaco=${farmaco}`);
-        await fetchRecent(urls);
+        // with the stream open the new row arrives on its own
+        if (!streamOpen) await fetchRecent(urls);
       } catch (e) {
         const msg = (e && e.message) ? e.message : String(e);
         showCardError(card, "Errore: " + msg);
@@ -233,6 +260,7 @@
     log(`init add=${urls.add} recent=${urls.recent}`);
     $all("[data-pillole-card]").forEach((card) => wireCard(card, urls));
     fetchRecent(urls);
+    openStream(urls);
   }
 
   if (document.readyState === "loading") {
@@ -64,7 +64,7 @@
     document.head.appendChild(s);
   }
 
-  async function loadCfg(){ try{ const r=await fetch(CONFIG_URL,{cache:'no-store'}); if(r.ok) return parseCfg(await r.text()); }catch(e){} return {'*':[]}; }
+  async function loadCfg(){ try{ const txt=await window.configText('timestamp_columns.txt', async()=>{ const r=await fetch(CONFIG_URL,{cache:'no-store'}); return r.ok ? r.text() : null; }); if(txt) return parseCfg(txt); }catch(e){} return {'*':[]}; }
 
   function readyForMeasure(table, idxs){
     // it's ok to compute immediately; if your own formatter runs later, this still forces nowrap + min-width